@@ -14,12 +14,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import heapq
+import multiprocessing
 import sqlite3
 import os
 import sys
+import threading
+from functools import partial
 from typing import Tuple, List, Dict, Optional
 
 from gamestate import GameState
+from playout import playout_value
+from statestore import (StateStore, SQLiteStateStore, FLUSH_STATES, FLUSH_MS, ask_store_kind, board_cells,
+                        open_store, store_path)
+
+# Frontier states expanded together when evaluating with batcheval
+EVAL_BATCH_SIZE = 4096
+# Frontier states handed to a worker process at a time in parallel expansion
+WORKER_BATCH_SIZE = 256
+# Batches handed to the pool per worker before their children are stored
+WORKER_BACKLOG = 2
+# GameOver value for states with moves left whose score upper bound cannot
+# beat the best score found, stored so they are never expanded
+DEAD_END = 2
 
 
 def clear_tables(conn):
@@ -29,6 +46,7 @@ def clear_tables(conn):
         cursor.execute("DELETE FROM GameTree")
         cursor.execute("DELETE FROM Moves")
         cursor.execute("COMMIT")
+        getattr(conn, 'state_ids', {}).clear()
         print("All tables cleared successfully\n")
     except sqlite3.Error as e:
         conn.rollback()
@@ -52,30 +70,6 @@ def execute_query(conn, query, params=None):
 
 def main():
     db_path = os.path.expanduser('~/Database/GameTree.db') # Replace with your actual database path
-    db_path_read = 'file:' + db_path + '?readonly'
-
-    # Establish connections to the database
-    write_conn = None
-    try:
-
-        write_conn = sqlite3.connect(db_path)
-
-        # write_conn.execute("PRAGMA journal_mode=WAL;")
-        write_conn.execute("PRAGMA journal_mode=MEMORY;")
-        write_conn.execute("PRAGMA synchronous=NORMAL;")
-        write_conn.execute("PRAGMA cache_size=-1048576;")
-        # write_conn.execute("PRAGMA mmap_size=30064771072;")  # 28GB mmap
-        write_conn.execute("PRAGMA busy_timeout=30000;")
-        # write_conn.execute("PRAGMA page_size=32768;")
-
-        print("Connected for write to the database.")
-
-    except sqlite3.Error as e:
-        print(f"Error connecting to database: {e}")
-
-    if write_conn is None:
-        print("Failed to connect to the database.")
-        return
 
     # Initialize start
     # user_input = input("Clear database Y or N?: ").strip().lower()
@@ -85,40 +79,144 @@ def main():
     current_game = None
     user_input = input("Add a random start state Y or N?: ").strip().lower()
     if user_input == 'y':
-        current_game = GameState()
+        deal_input = input("Enter deal number (or press Enter for a random deal): ").strip()
+        if deal_input:
+            current_game = GameState.from_deal(int(deal_input))
+        else:
+            current_game = GameState()
 
     if user_input == 'n':
         filename = input("Enter filename to load: ")
         if filename:
             current_game = GameState.load_game(filename)
 
-    search_fraction = None
-    user_input = input("Set search breadth fraction: ").strip().lower()
-    if user_input:
-        search_fraction = float(user_input.strip())
-    if not search_fraction:
-        search_fraction = 0.75 # Originally was 0.95
-    print(search_fraction)
+    # Fraction mode rescans the frontier each iteration, best-first keeps it in a heap,
+    # beam keeps a fixed number of states per depth and exhaustive expands every state
+    search_mode = input("Search mode (F)raction, (B)est-first, bea(M) or (E)xhaustive: ").strip().lower()
 
-    user_input = input("Set iterations to explore: ").strip().lower()
-    num_iter = int(user_input.strip())
+    # Only fraction search reads the SQLite tables itself, the others run on any state store
+    store_kind = 'sqlite'
+    if search_mode in ('b', 'm', 'e'):
+        store_kind = ask_store_kind()
+
+    search_fraction = None
+    num_iter = 0
+    max_states = 0
+    beam_width = 0
+    max_depth = 0
+    if search_mode == 'b':
+        user_input = input("Set states to expand: ").strip().lower()
+        max_states = int(user_input.strip())
+    elif search_mode == 'm':
+        user_input = input("Set beam width: ").strip().lower()
+        beam_width = int(user_input.strip())
+        user_input = input("Set depth to search: ").strip().lower()
+        max_depth = int(user_input.strip())
+    elif search_mode != 'e':
+        user_input = input("Set search breadth fraction (Enter=0.75): ").strip().lower()
+        if user_input:
+            search_fraction = float(user_input.strip())
+        if search_fraction is None:
+            search_fraction = 0.75 # Originally was 0.95
+        print(search_fraction)
+
+        user_input = input("Set iterations to explore: ").strip().lower()
+        num_iter = int(user_input.strip())
 
     user_input = input("Set start state to explore (0=All): ").strip().lower()
     start_id = int(user_input.strip())
 
-    # Insert the initial state if specified into the database
+    # Store row permutations of a position once, as their canonical board.
+    # Best kept the same for the whole life of a database.
+    user_input = input("Deduplicate row permutations Y or N?: ").strip().lower()
+    canonical = user_input == 'y'
+
+    # Rank the frontier on the mean score of greedy playouts instead of LineLenVal,
+    # LineLenVal is still what is stored
+    playouts = 0
+    if search_mode in ('b', 'm'):
+        user_input = input("Set playouts per state to rank on (Enter=LineLenVal): ").strip().lower()
+        playouts = int(user_input) if user_input else 0
+
+    # Hold new rows in memory and commit them together, losing at most one interval on a crash
+    user_input = input(f"Set states per commit (1=Every state, Enter={FLUSH_STATES}): ").strip().lower()
+    flush_states = int(user_input) if user_input else FLUSH_STATES
+    user_input = input(f"Set milliseconds per commit (0=None, Enter={FLUSH_MS}): ").strip().lower()
+    flush_ms = float(user_input) if user_input else FLUSH_MS
+
+    # Leave out moves that reach a child already reached with the moves the other way round.
+    # Only sound when every state is expanded, a partial search can lose those children
+    sleep_sets = False
+    if search_mode == 'e':
+        user_input = input("Skip commuting move orders Y or N?: ").strip().lower()
+        sleep_sets = user_input == 'y'
+
+    # Needs NumPy, evaluates the children of EVAL_BATCH_SIZE states at a time
+    batch_eval = False
+    workers = 1
+    if search_mode not in ('b', 'm', 'e'):
+        user_input = input("Evaluate states in NumPy batches Y or N?: ").strip().lower()
+        batch_eval = user_input == 'y'
+        if not batch_eval:
+            user_input = input(f"Set worker processes (1-{os.cpu_count()}, Enter=1): ").strip().lower()
+            workers = int(user_input) if user_input else 1
+
+    try:
+        store = open_store(store_kind, store_path(store_kind, db_path))
+        print(f"Opened the {store_kind} state store.")
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Error opening state store: {e}")
+        return
+
+    # Insert the initial state if specified into the store
     if current_game:
         try:
-            # Insert the initial state into the database
-            insert_game_state(write_conn, current_game)
-            write_conn.commit()
+            insert_start_state(store, current_game)
+            store.commit()
 
         except sqlite3.Error as e:
             # If any operation fails, rollback the entire transaction
-            write_conn.rollback()
+            store.rollback()
             print(f"Error during insertion: {e}")
 
+    store.buffer_writes(flush_states, flush_ms)
+
+    if search_mode == 'b':
+        best_first_search(store, start_id, max_states, canonical, playouts)
+        store.close()
+        return
+
+    if search_mode == 'e':
+        exhaustive_search(store, start_id, canonical, sleep_sets)
+        store.close()
+        return
+
+    if search_mode == 'm':
+        start_ids = store.start_states() if start_id == 0 else [start_id]
+        for beam_start in start_ids:
+            print(f"\nBeam search from start state {beam_start}")
+            beam_search(store, beam_start, beam_width, max_depth, canonical, playouts)
+        store.close()
+        return
+
+    fraction_search(store, start_id, search_fraction, num_iter, canonical, batch_eval, workers)
+    store.close()
+
+
+def fraction_search(store: SQLiteStateStore, start_id: int, search_fraction: float,
+                    num_iter: int, canonical: bool = False, batch_eval: bool = False,
+                    workers: int = 1) -> bool:
+    """
+    Expand the unexpanded states within search_fraction of the best LineLenVal, num_iter times
+
+    The frontier is read through a second, read-only connection to the
+    store's database, so this needs a SQLiteStateStore. start_id 0 searches
+    every start state in the database. Returns True if a solution was
+    found.
+    """
+    db_path_read = 'file:' + store.db_path + '?readonly'
     next_iter = 0
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
 
     # results1 = []
     solution_found = False
@@ -136,21 +234,19 @@ def main():
         if start_id == 0:
             query = """
             SELECT StartState, MAX(LineLenVal), MAX(DepthLvl), MAX(Score)
-            FROM GameTree
+            FROM GameTree INDEXED BY idx_frontier
             WHERE GameOver = '0' 
-            AND GameState NOT IN (SELECT FromState
-                                        FROM Moves)
+            AND Expanded = 0
             GROUP BY StartState
             """
             results1 = execute_query(read_conn, query)
         else:
             query = """
             SELECT StartState, MAX(LineLenVal), MAX(DepthLvl), MAX(Score)
-            FROM GameTree
+            FROM GameTree INDEXED BY idx_frontier
             WHERE GameOver = '0'
+            AND Expanded = 0
             AND StartState = ?
-            AND GameState NOT IN (SELECT FromState
-                                        FROM Moves)
             GROUP BY StartState  
             """
             results1 = execute_query(read_conn, query, (start_id, ))
@@ -169,13 +265,13 @@ def main():
 
             query = """
             SELECT StartState, GameState, Board, DepthLvl
-            FROM GameTree
+            FROM GameTree INDEXED BY idx_frontier
             WHERE GameOver = '0'
+            AND Expanded = 0
             AND StartState = ? 
             AND DepthLvl <= ?
             AND LineLenVal >= ?
-            AND GameState NOT IN (SELECT FromState
-                                  FROM Moves)
+            ORDER BY GameState
             """
             results2 = execute_query(read_conn, query,
                                      (state_id, max_depth, line_len_val * search_fraction))
@@ -184,29 +280,23 @@ def main():
                 print(f"No more states to expand at iteration {next_iter}")
                 break
 
-            progress_counter = 0
-            if results2:
-                print(f"Processing iteration: {next_iter}")
-                for row in results2:
-                    start_state = row[0]
-                    state_id = row[1]
-                    current_board = row[2]
-                    current_depth = row[3]
-                    total_states += 1
-                    # Explore next state
-                    expanded, solution_found = expand_tree(write_conn, start_state, state_id, current_board, current_depth)
-                    total_moves += expanded
-
-                    if solution_found:
-                        print(f"\nSolution found! Perfect score of 48 achieved.")
-                        break
-
-                    sys.stdout.write('.')
-                    sys.stdout.flush()
-                    progress_counter += 1
-                    if progress_counter % 80 == 0:  # Start a new line every so often
-                        print()
+            print(f"Processing iteration: {next_iter}")
+            if pool:
+                steps = pool_steps(pool, store, results2, workers, canonical, max_score)
+            elif batch_eval:
+                batches = [results2[batch_start:batch_start + EVAL_BATCH_SIZE]
+                           for batch_start in range(0, len(results2), EVAL_BATCH_SIZE)]
+                steps = ((len(batch), expand_batch(store, batch, canonical, max_score)) for batch in batches)
+            else:
+                steps = ((1, expand_tree(store, start_state, state_id, board_cells(board), depth, canonical,
+                                         best_score=max_score))
+                         for start_state, state_id, board, depth in results2)
+            total_states, total_moves, solution_found = run_steps(steps)
+            if solution_found:
+                break
 
+        # The next iteration reads through read_conn, which only sees committed rows
+        store.commit()
         print(f'\nStates: {total_states} Moves: {total_moves}')
         next_iter += 1
         read_conn.close()
@@ -214,84 +304,499 @@ def main():
         if solution_found:
             break
 
-    write_conn.close()
+    if pool:
+        pool.terminate()
+    return solution_found
 
 
-def expand_tree(conn: sqlite3.Connection, start_state: int, state_id: int, board: str, depth: int) -> Tuple[int, bool]:
-    """ Expand the game tree with all possible moves for the input state """
+def run_steps(steps) -> Tuple[int, int, bool]:
+    """
+    Run the expansion steps of a fraction search iteration, printing a dot for each
+
+    steps yields (states expanded, (moves stored, solution found)) and is
+    stopped at a solution. Returns the states and moves totals and whether
+    a solution was found.
+    """
+    total_states = 0
+    total_moves = 0
+    solution_found = False
+    progress_counter = 0
     try:
-        cursor = conn.cursor()
-        game = GameState.load_game(board)
-        expanded_count = 0
+        for states, (expanded, solution_found) in steps:
+            total_states += states
+            total_moves += expanded
+
+            if solution_found:
+                print(f"\nSolution found! Perfect score of 48 achieved.")
+                break
+
+            sys.stdout.write('.')
+            sys.stdout.flush()
+            progress_counter += 1
+            if progress_counter % 80 == 0:  # Start a new line every so often
+                print()
+    finally:
+        steps.close()
+    return total_states, total_moves, solution_found
+
+
+def pool_steps(pool, store: StateStore, rows: List[Tuple[int, int, str, int]],
+               workers: int, canonical: bool = False, best_score: int = 0):
+    """
+    Expand rows in WORKER_BATCH_SIZE batches on the pool, yielding run_steps steps
+
+    Workers evaluate batches in parallel and this process is the only
+    writer, storing the children of each batch in order. A batch goes to
+    the pool as soon as the children of an earlier one are stored, so the
+    workers always have up to WORKER_BACKLOG batches each to work on and
+    the children waiting to be stored never exceed that.
+    """
+    batches = [rows[batch_start:batch_start + WORKER_BATCH_SIZE]
+               for batch_start in range(0, len(rows), WORKER_BATCH_SIZE)]
+    in_flight = threading.Semaphore(workers * WORKER_BACKLOG)
+    stopped = threading.Event()
+
+    def throttled_batches():
+        # Runs in the pool's task thread, which waits here for room in the backlog
+        for batch in batches:
+            in_flight.acquire()
+            if stopped.is_set():
+                return
+            yield batch
+
+    results = pool.imap(partial(compute_children, canonical=canonical, best_score=best_score),
+                        throttled_batches())
+    try:
+        for batch, children in zip(batches, results):
+            step = store_children(store, children)
+            in_flight.release()
+            yield len(batch), step
+    finally:
+        # Let the task thread out of throttled_batches when stopped at a solution
+        stopped.set()
+        in_flight.release()
+
+
+def best_first_search(store: StateStore, start_id: int, max_states: int,
+                      canonical: bool = False, playouts: int = 0) -> bool:
+    """
+    Expand up to max_states states in best-first order, returns True if a solution was found
+
+    The unexpanded frontier is read from the store once and then kept in
+    a heap ordered on highest LineLenVal, then highest Score, then lowest
+    DepthLvl, so the next state is popped in O(log n) instead of rescanning
+    GameTree. Children are still written to the store as the record.
+    With playouts set, the mean score of that many greedy playouts from
+    each state ranks it in place of LineLenVal.
+    """
+    # Boards are only read to run playouts, the heap holds IDs and the state is read when popped
+    states = store.frontier(start_id, with_cells=bool(playouts))
+
+    # Heap entries are (-LineLenVal, -Score, DepthLvl, GameState, StartState),
+    # the playout value standing in for LineLenVal when ranking on playouts
+    if playouts:
+        frontier = [(-playout_value(GameState(bytearray(state.cells)), playouts), -state.score, state.depth,
+                     state.state_id, state.start_state) for state in states]
+    else:
+        frontier = [(-state.line_len_val, -state.score, state.depth, state.state_id, state.start_state)
+                    for state in states]
+    heapq.heapify(frontier)
+    print(f"Frontier states: {len(frontier)}")
+
+    total_states = 0
+    total_moves = 0
+    max_score = 0
+    best_scores = {}
+    solution_found = False
+    while frontier and total_states < max_states:
+        neg_line_len_val, neg_score, depth, state_id, start_state = heapq.heappop(frontier)
+        state = store.get_state(state_id)
+        if state is None:
+            continue
+
+        new_states = []
+        best_scores[start_state] = max(best_scores.get(start_state, 0), -neg_score)
+        expanded, solution_found = expand_tree(store, start_state, state_id, state.cells, depth,
+                                               canonical, new_states, best_scores[start_state], playouts)
+        total_states += 1
+        total_moves += expanded
+        max_score = max(max_score, -neg_score)
+
+        if solution_found:
+            print(f"\nSolution found! Perfect score of 48 achieved.")
+            break
+
+        for line_len_val, score, new_depth, new_state_id, game_over in new_states:
+            if not game_over:
+                heapq.heappush(frontier, (-line_len_val, -score, new_depth, new_state_id, start_state))
+
+        sys.stdout.write('.')
+        sys.stdout.flush()
+        if total_states % 80 == 0:  # Start a new line every so often
+            print(f" {total_states} Max Score {max_score} Frontier {len(frontier)}")
+
+    store.commit()
+    print(f'\nStates: {total_states} Moves: {total_moves} Frontier: {len(frontier)}')
+    return solution_found
+
+
+def exhaustive_search(store: StateStore, start_id: int, canonical: bool = False,
+                      sleep_sets: bool = False) -> bool:
+    """
+    Expand every unexpanded state still in play until none are left, returns True if a solution was found
+
+    Each pass expands the frontier as it stood when the pass began,
+    shallowest first, and the children it stores make up the next pass.
+    As every state is expanded, sleep_sets loses nothing: a child left out
+    is stored through the parent that makes the moves the other way round.
+    Only dead ends cut the tree short, as in the other searches.
+    """
+    total_states = 0
+    total_moves = 0
+    best_scores = {}
+    solution_found = False
+    search_pass = 0
+    while not solution_found:
+        states = sorted(store.frontier(start_id), key=lambda state: state.depth)
+        if not states:
+            print("\nSearch ended, no unexpanded states left")
+            break
+        print(f"\nPass {search_pass} Frontier states: {len(states)}")
+        for state in states:
+            best_scores[state.start_state] = max(best_scores.get(state.start_state, 0), state.score)
+
+        for state in states:
+            expanded, solution_found = expand_tree(store, state.start_state, state.state_id, state.cells,
+                                                   state.depth, canonical,
+                                                   best_score=best_scores[state.start_state],
+                                                   sleep_sets=sleep_sets)
+            total_states += 1
+            total_moves += expanded
+
+            if solution_found:
+                print(f"\nSolution found! Perfect score of 48 achieved.")
+                break
+
+            sys.stdout.write('.')
+            sys.stdout.flush()
+            if total_states % 80 == 0:  # Start a new line every so often
+                print(f" {total_states}")
+
+        store.commit()
+        search_pass += 1
+
+    print(f'\nStates: {total_states} Moves: {total_moves}')
+    return solution_found
+
+
+def state_values(game: GameState, best_score: int = 0) -> Tuple[int, int, int, int, float]:
+    """
+    Return the (Score, GameOver, ActiveSpaces, TotLineLen, LineLenVal) columns for a state
+
+    GameOver is DEAD_END when the state's score upper bound cannot beat
+    best_score or its own score, so nothing below it is worth expanding.
+    """
+    score = game.calculate_score()
+    game_over = game.is_game_over()
+    if not game_over and game.score_upper_bound() <= max(score, best_score):
+        game_over = DEAD_END
+    game.calc_line_len()
+    active_spaces = sum(1 for lt in game.line_len if lt > 0)
+    tot_line_len = game.tot_line_len
+    line_len_val = 0.0
+
+    # Check if this state is a solution
+    if score < 48:
+        line_len_val = (tot_line_len + score) / (48.0 - score)
+
+    return score, game_over, active_spaces, tot_line_len, line_len_val
+
+
+def beam_search(store: StateStore, start_id: int, beam_width: int, max_depth: int,
+                canonical: bool = False, playouts: int = 0) -> bool:
+    """
+    Search layer by layer from the start state keeping the best beam_width states per depth
+
+    Children of the current layer are generated and evaluated in memory, and
+    only the beam_width with the highest LineLenVal (then Score) are written
+    to the store and expanded next. Memory and store growth are
+    bounded by beam_width x depth. Returns True if a solution was found.
+    With playouts set, children are kept on the mean score of that many
+    greedy playouts instead of LineLenVal.
+    """
+    start = store.get_state(start_id)
+    if start is None:
+        print(f"No start state {start_id}")
+        return False
+
+    game = GameState(bytearray(start.cells))
+    seen = {game.canonical_key() if canonical else game.key()}
+    layer = [(start_id, start.cells)]
+    max_score = 0
+
+    try:
+        for depth in range(start.depth, start.depth + max_depth):
+            # Evaluate every new child of the layer, keyed on board hash
+            candidates = {}
+            for state_id, cells in layer:
+                game = GameState(bytearray(cells))
+                for space_index in range(4):
+                    space_moves = game.move_cells[space_index]
+                    if space_moves:
+                        to_cell = game.space_cells[space_index]
+                        for move_index in range(len(space_moves)):
+                            undo = game.make_move(space_index, move_index)
+                            key = game.canonical_key() if canonical else game.key()
+                            if key not in seen and key not in candidates:
+                                new_cells = game.canonical_cells() if canonical else game.to_bytes()
+                                values = state_values(game, max_score)
+                                rank = playout_value(game, playouts) if playouts else values[4]
+                                candidates[key] = (values, rank, state_id, new_cells,
+                                                   space_moves[move_index], to_cell)
+                            game.unmake_move(undo)
+
+            if not candidates:
+                print(f"\nNo more states to expand at depth {depth}")
+                break
+
+            # Keep the best of the layer on LineLenVal (or playout value), then Score
+            beam = heapq.nlargest(beam_width, candidates.items(),
+                                  key=lambda item: (item[1][1], item[1][0][0]))
+            layer = []
+            parents = set()
+            solution_found = False
+            for key, (values, rank, state_id, new_cells, from_cell, to_cell) in beam:
+                parents.add(state_id)
+                new_score, game_over, active_spaces, tot_line_len, line_len_val = values
+                new_state_id, _ = store.put_state(start_id, key, new_cells, new_score, active_spaces,
+                                                  tot_line_len, line_len_val, game_over, depth + 1)
+                store.add_edge(start_id, state_id, new_state_id, from_cell, to_cell)
+                seen.add(key)
+                max_score = max(max_score, new_score)
+                solution_found = solution_found or new_score == 48
+                if not game_over:
+                    layer.append((new_state_id, new_cells))
+            for parent in parents:
+                store.mark_expanded(parent)
+            store.commit_writes(len(parents), force=solution_found)
+
+            print(f"Depth {depth + 1} Candidates {len(candidates)} Kept {len(beam)} Max Score {max_score}")
+            if solution_found:
+                print(f"\nSolution found! Perfect score of 48 achieved.")
+                return True
+        store.commit()
+
+    except sqlite3.Error as e:
+        store.rollback()
+        print(f"Error in beam search: {e}")
+
+    return False
+
+
+def expand_tree(store: StateStore, start_state: int, state_id: int, cells: bytes, depth: int,
+                canonical: bool = False, new_states: Optional[list] = None,
+                best_score: int = 0, playouts: int = 0, sleep_sets: bool = False) -> Tuple[int, bool]:
+    """
+    Expand the game tree with all possible moves for the input state
+
+    With canonical set, child boards are stored with their rows sorted so
+    each row permutation of a position is only stored and expanded once.
+    Move cells always refer to the parent board as stored.
+    If new_states is given, (LineLenVal, Score, DepthLvl, GameState, GameOver)
+    is appended for each child not already in the store, with the mean
+    score of playouts greedy playouts in place of LineLenVal if playouts
+    is set. Children that cannot beat best_score are stored as DEAD_END.
+
+    With sleep_sets set, moves in the sleep set of the stored moves into
+    the state are left out, as the same children are reached with the
+    moves the other way round. That only holds if the other parent is
+    expanded too, so only exhaustive_search sets it: fraction, best-first
+    and beam searches leave states unexpanded and would lose those children.
+    Move coordinates do not fit sorted rows, so this is off with
+    canonical set. With a fixed move order the sleep set is complete, so
+    a state is never expanded again for a move stored into it later.
+    """
+    expanded_count = 0
+    try:
+        game = GameState(bytearray(cells))
+
+        sleep = set()
+        if sleep_sets and not canonical:
+            sleep = game.sleep_set([(from_cell, to_cell) for _, from_cell, to_cell in store.moves_into(state_id)])
+        if sleep and len(sleep) == sum(len(moves) for moves in game.move_cells if moves):
+            # Keep at least one move so the state is seen as expanded
+            sleep = set()
 
         for space_index in range(4):
-            if game.moves[space_index]:
-                for move_index in range(len(game.moves[space_index])):
-                    new_game = GameState.load_game(board)
-                    # Apply move
-                    new_game.make_move(space_index, move_index)
-                    from_rowcol = game.moves[space_index][move_index]
-                    to_rowcol = game.spaces[space_index]
-                    new_board = new_game.save_game()
-                    new_score = new_game.calculate_score()
-                    game_over = new_game.is_game_over()
-                    new_game.calc_line_len()
-                    active_spaces = sum(1 for lt in new_game.line_len if lt > 0)
-                    tot_line_len = new_game.tot_line_len
-                    line_len_val = 0.0
-
-                    # Check if this new state is a solution
-                    if new_score < 48:
-                        line_len_val = (tot_line_len + new_score) / (48.0 - new_score)
-
-                    # Insert new game state
-                    cursor.execute("""
-                    INSERT OR IGNORE INTO 
-                    GameTree (StartState, Board, Score, ActiveSpaces, 
-                                TotLineLen, LineLenVal, GameOver, DepthLvl)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (start_state, new_board, new_score, active_spaces,
-                          tot_line_len, line_len_val, game_over, depth + 1))
-
-                    # Get the ID of the new state (or existing state if it was already in the table)
-                    query = """
-                    SELECT GameState 
-                    FROM GameTree 
-                    WHERE StartState = ? 
-                    AND Board = ?
-                    """
-                    results = execute_query(conn, query, (start_state, new_board))
-                    new_state_id = results[0][0]
-
-                    # Insert move
-                    cursor.execute("""
-                    INSERT OR IGNORE INTO 
-                    Moves (StartState, FromState, ToState, MoveFromRow, MoveFromCol, MoveToRow, MoveToCol)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (start_state, state_id, new_state_id, from_rowcol[0], from_rowcol[1], to_rowcol[0], to_rowcol[1]))
+            space_moves = game.move_cells[space_index]
+            if space_moves:
+                to_cell = game.space_cells[space_index]
+                for move_index in range(len(space_moves)):
+                    from_cell = space_moves[move_index]
+                    if (from_cell, to_cell) in sleep:
+                        continue
+
+                    # Apply move in place, it is undone once the child is evaluated
+                    undo = game.make_move(space_index, move_index)
+                    new_cells = game.canonical_cells() if canonical else game.to_bytes()
+                    key = game.canonical_key() if canonical else game.key()
+                    new_score, game_over, active_spaces, tot_line_len, line_len_val = state_values(game, best_score)
+                    rank = line_len_val
+                    if playouts and new_states is not None and not game_over:
+                        rank = playout_value(game, playouts)
+                    game.unmake_move(undo)
+
+                    # Store new game state and the move to it
+                    new_state_id, inserted = store.put_state(start_state, key, new_cells, new_score, active_spaces,
+                                                             tot_line_len, line_len_val, game_over, depth + 1)
+                    store.add_edge(start_state, state_id, new_state_id, from_cell, to_cell)
+                    if inserted and new_states is not None:
+                        new_states.append((rank, new_score, depth + 1, new_state_id, game_over))
 
                     if new_score == 48:
-                        conn.commit()
+                        store.mark_expanded(state_id)
+                        store.commit_writes(force=True)
                         return expanded_count, True
 
             expanded_count += 1
-            conn.commit()
+        store.mark_expanded(state_id)
+        store.commit_writes()
+        return expanded_count, False
 
     except sqlite3.Error as e:
-        conn.rollback()
+        store.rollback()
         print(f"Error expanding game tree: {e}")
 
     return expanded_count, False
 
-def insert_game_state(conn, game_state):
-    """Insert a new game state into the database."""
+
+def expand_batch(store: StateStore, rows: List[Tuple[int, int, str, int]],
+                 canonical: bool = False, best_score: int = 0) -> Tuple[int, bool]:
+    """
+    Expand a batch of (StartState, GameState, Board, DepthLvl) rows, evaluating all children at once
+
+    Children are made, evaluated, bounded and keyed in NumPy, so Python
+    only hands each one to the store, which builds board text only for
+    children it has not seen. They are stored in the same order and with
+    the same values as expand_tree would store them. Returns the number
+    of moves stored.
+    """
+    import batcheval  # NumPy is only needed for batch evaluation
+
+    parent_index, from_cells, to_cells, children = batcheval.child_boards(
+        batcheval.boards_from_text([board for _, _, board, _ in rows]))
+    if not len(children):
+        return 0, False
+    if canonical:
+        children = batcheval.canonical_boards(children)
+
+    results = batcheval.evaluate(children)
+    scores = results['score'].tolist()
+    game_over = [DEAD_END if not over and bound <= max(score, best_score) else over
+                 for score, over, bound in zip(scores, results['game_over'].tolist(),
+                                               batcheval.score_upper_bound(children).tolist())]
+    values = zip(scores, game_over, results['active_spaces'].tolist(),
+                 results['tot_line_len'].tolist(), results['line_len_val'].tolist())
+    data = children.tobytes()
+    board_size = children[0].size
+    return store_children(store, [(rows[parent][0], rows[parent][1], data[child * board_size:(child + 1) * board_size],
+                                   child_values, rows[parent][3] + 1, from_cell, to_cell, key)
+                                  for child, (parent, from_cell, to_cell, key, child_values)
+                                  in enumerate(zip(parent_index.tolist(), from_cells.tolist(), to_cells.tolist(),
+                                                   batcheval.zobrist_keys(children).tolist(), values))])
+
+
+def compute_children(rows: List[Tuple[int, int, str, int]], canonical: bool = False,
+                     best_score: int = 0) -> List[tuple]:
+    """
+    Evaluate the children of (StartState, GameState, Board, DepthLvl) rows without the store
+
+    Runs in the worker processes of parallel expansion. Returns rows for
+    store_children in the order expand_tree would store them.
+    """
+    children = []
+    for start_state, state_id, board, depth in rows:
+        game = GameState.from_board(board)
+        for space_index in range(4):
+            space_moves = game.move_cells[space_index]
+            if space_moves:
+                to_cell = game.space_cells[space_index]
+                for move_index in range(len(space_moves)):
+                    undo = game.make_move(space_index, move_index)
+                    new_cells = game.canonical_cells() if canonical else game.to_bytes()
+                    key = game.canonical_key() if canonical else game.key()
+                    values = state_values(game, best_score)
+                    game.unmake_move(undo)
+                    children.append((start_state, state_id, new_cells, values, depth + 1,
+                                     space_moves[move_index], to_cell, key))
+    return children
+
+
+def store_children(store: StateStore, children: List[tuple]) -> Tuple[int, bool]:
+    """
+    Write child rows from compute_children in one transaction
+
+    Returns the number of moves stored and whether a solution was found.
+    """
+    expanded_count = 0
+    try:
+        parents = set()
+        for start_state, state_id, new_cells, values, new_depth, from_cell, to_cell, key in children:
+            new_score, game_over, active_spaces, tot_line_len, line_len_val = values
+            parents.add(state_id)
+
+            # Store new game state and the move to it
+            new_state_id, _ = store.put_state(start_state, key, new_cells, new_score, active_spaces,
+                                              tot_line_len, line_len_val, game_over, new_depth)
+            store.add_edge(start_state, state_id, new_state_id, from_cell, to_cell)
+            expanded_count += 1
+
+            if new_score == 48:
+                for parent in parents:
+                    store.mark_expanded(parent)
+                store.commit_writes(force=True)
+                return expanded_count, True
+
+        for parent in parents:
+            store.mark_expanded(parent)
+        store.commit_writes(len(parents))
+
+    except sqlite3.Error as e:
+        store.rollback()
+        print(f"Error storing game tree children: {e}")
+
+    return expanded_count, False
+
+
+def insert_start_state(store: StateStore, game_state: GameState) -> int:
+    """ Store a game as a start state unless it is one already, returns its ID """
+    score = game_state.calculate_score()
+    game_over = game_state.is_game_over()
+    game_state.calc_line_len()
+    active_spaces = sum(1 for lt in game_state.line_len if lt > 0)
+    state_id, inserted = store.put_state(0, game_state.key(), game_state.cells, score, active_spaces,
+                                         game_state.tot_line_len, 0, game_over, 0)
+    if inserted:
+        print(f"Inserted new game state with ID: {state_id}")
+    else:
+        print(f"Game state already stored with ID: {state_id}")
+    print(f"GameState: {state_id}, Score: {score}, Depth: 0")
+    print(f"Board:\n{game_state.save_game()}\n")
+    return state_id
+
+
+def insert_game_state(conn, game_state, state_id: Optional[int] = None):
+    """
+    Insert a new game state into the database as a start state, returns its GameState ID
+
+    state_id sets the ID explicitly, otherwise SQLite assigns the next one.
+    """
     try:
         cursor = conn.cursor()
         query = """
-        INSERT INTO GameTree (Board, Score, ActiveSpaces, TotLineLen, 
+        INSERT INTO GameTree (GameState, Board, Score, ActiveSpaces, TotLineLen, 
                                 LineLenVal, GameOver, DepthLvl)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """
         board_str = game_state.save_game()  # Assuming __str__ method gives the board representation
         score = game_state.calculate_score()
@@ -303,7 +808,7 @@ def insert_game_state(conn, game_state):
         line_len_val = 0
 
         cursor.execute(query,
-                       (board_str, score, active_spaces, tot_line_len,
+                       (state_id, board_str, score, active_spaces, tot_line_len,
                         line_len_val, game_over, depth))
         state_id = cursor.lastrowid
         print(f"Inserted new game state with ID: {state_id}")
@@ -338,6 +843,7 @@ def insert_game_state(conn, game_state):
         return None
 
     cursor.close()
+    return state_id
 
 
 if __name__ == "__main__":
@@ -0,0 +1,282 @@
+# SpacesAces - Batched NumPy evaluation of many game states at once
+# Copyright (C) 2024 John Barron <jbarronuk@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+from gamestate import (EMPTY, NUM_CARDS, NUM_CELLS, NUM_ROWS, ROW_LEN,
+                       CARD_ID, CARD_RANK, CELL_COL, NEXT_CARD, ZOBRIST, ZOBRIST_STRIDE)
+
+# Lookup tables as arrays for fancy indexing
+NEXT = np.frombuffer(NEXT_CARD, dtype=np.uint8).astype(np.intp)
+IS_ACE = np.frombuffer(CARD_RANK, dtype=np.uint8) == 0
+COL = np.frombuffer(CELL_COL, dtype=np.uint8).astype(np.intp)
+ZOBRIST_TABLE = np.array(ZOBRIST, dtype=np.uint64).reshape(NUM_CELLS, ZOBRIST_STRIDE)
+# The card before each card in its suit, EMPTY for aces
+PREV = np.where(IS_ACE[:NUM_CARDS], EMPTY, np.arange(NUM_CARDS) - 1)
+
+MAX_ACE_MOVES = 4
+
+
+def boards_from_text(boards: Iterable[str]) -> np.ndarray:
+    """ Convert save_game board strings to an (N, 4, 14) int8 array """
+    cells = bytearray()
+    for board in boards:
+        cells += bytes([CARD_ID[card_str] for card_str in board.split()])
+    return np.frombuffer(bytes(cells), dtype=np.int8).reshape(-1, NUM_ROWS, ROW_LEN)
+
+
+def boards_from_bytes(boards: Iterable[bytes]) -> np.ndarray:
+    """ Convert GameState.to_bytes boards to an (N, 4, 14) int8 array """
+    return np.frombuffer(b''.join(boards), dtype=np.int8).reshape(-1, NUM_ROWS, ROW_LEN)
+
+
+def positions(cells: np.ndarray) -> np.ndarray:
+    """ Return the (N, 53) cell of every card id, the last column is unused """
+    count = len(cells)
+    pos = np.zeros((count, NUM_CARDS + 1), dtype=np.int16)
+    pos[np.arange(count)[:, None], cells] = np.arange(NUM_CELLS, dtype=np.int16)
+    return pos
+
+
+def space_cells(cells: np.ndarray) -> np.ndarray:
+    """ Return the (N, 4) space cells in board order, as GameState.from_board finds them """
+    return np.nonzero(cells == EMPTY)[1].reshape(-1, 4)
+
+
+def legal_moves(boards: np.ndarray) -> np.ndarray:
+    """
+    Return the (N, 4, 4) source cells of the moves for each space, -1 for none.
+
+    Moves are in the same order as GameState.move_cells for a board loaded
+    with from_board: first column spaces list the open aces in board order,
+    other spaces have at most one move.
+    """
+    cells = boards.reshape(-1, NUM_CELLS).astype(np.intp)
+    count = len(cells)
+    rows = np.arange(count)[:, None]
+    pos = positions(cells)
+    spaces = space_cells(cells)
+    moves = np.full((count, 4, MAX_ACE_MOVES), -1, dtype=np.intp)
+
+    # Successor of the card to the left of each space
+    next_card = NEXT[cells[rows, np.maximum(spaces - 1, 0)]]
+    has_move = (COL[spaces] > 0) & (next_card != EMPTY)
+    moves[:, :, 0] = np.where(has_move, pos[rows, next_card], -1)
+
+    # Open aces, in board order and padded with -1
+    open_aces = IS_ACE[cells] & (COL[np.arange(NUM_CELLS)] > 0)
+    ace_cells = np.where(open_aces, np.arange(NUM_CELLS), NUM_CELLS)
+    ace_cells = np.sort(ace_cells, axis=1)[:, :MAX_ACE_MOVES]
+    ace_cells = np.where(ace_cells == NUM_CELLS, -1, ace_cells)
+    first_col = COL[spaces] == 0
+    moves[first_col] = ace_cells[np.nonzero(first_col)[0]]
+    return moves
+
+
+def calculate_score(boards: np.ndarray) -> np.ndarray:
+    """ Return the (N,) scores, the cards in sequence after each row's ace """
+    cells = boards.reshape(-1, NUM_ROWS, ROW_LEN).astype(np.intp)
+    aces = cells[:, :, 0]
+    in_sequence = cells[:, :, 1:13] == aces[:, :, None] + np.arange(1, 13)
+    in_sequence &= (aces != EMPTY)[:, :, None]
+    return np.cumprod(in_sequence, axis=2).sum(axis=(1, 2))
+
+
+def is_game_over(boards: np.ndarray) -> np.ndarray:
+    """ Return the (N,) flags for boards with no available moves """
+    return (legal_moves(boards) < 0).all(axis=(1, 2))
+
+
+def calc_line_len(boards: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the (N, 4) line lengths and (N,) total line lengths.
+
+    Runs the GameState.calc_line_len rules for all boards in lockstep.
+    Line moves never move an ace, so only cells and positions change,
+    and the space being followed is tracked by its cell.
+    """
+    base_cells = boards.reshape(-1, NUM_CELLS).astype(np.int16)
+    count = len(base_cells)
+    base_pos = positions(base_cells)
+    spaces = space_cells(base_cells)
+    line_len = np.zeros((count, 4), dtype=np.intp)
+
+    for space_index in range(4):
+        cells = base_cells.copy()
+        pos = base_pos.copy()
+        calc = spaces[:, space_index].copy()
+        active = np.flatnonzero(COL[calc] > 0)
+
+        while len(active):
+            calc_cell = calc[active]
+            row_start = calc_cell - COL[calc_cell]
+
+            # Track back over spaces to the left to the first card
+            temp_cell = calc_cell.copy()
+            temp_card = cells[active, temp_cell - 1]
+            back = (temp_card == EMPTY) & (temp_cell > row_start)
+            while back.any():
+                temp_cell = np.where(back, temp_cell - 1, temp_cell)
+                temp_card = np.where(back, cells[active, temp_cell], temp_card)
+                back = (temp_card == EMPTY) & (temp_cell > row_start)
+
+            # Stop at a blocking King or a row of spaces, otherwise fill from the next cell
+            going = NEXT[temp_card] != EMPTY
+            temp_cell += 1
+
+            # Apply preceding moves while possible
+            filling = going & (temp_cell < calc_cell)
+            while filling.any():
+                board_ix = active[filling]
+                target = temp_cell[filling]
+                move_card = NEXT[cells[board_ix, target - 1]]
+                movable = move_card != EMPTY
+                board_ix, target, move_card = board_ix[movable], target[movable], move_card[movable]
+                source = pos[board_ix, move_card]
+                cells[board_ix, target] = move_card
+                cells[board_ix, source] = EMPTY
+                pos[board_ix, move_card] = target
+
+                moved = np.flatnonzero(filling)[movable]
+                temp_cell[moved] += 1
+                filling[:] = False
+                filling[moved] = temp_cell[moved] < calc_cell[moved]
+
+            # Apply move
+            move_card = NEXT[cells[active, calc_cell - 1]]
+            going &= move_card != EMPTY
+            board_ix, target, move_card = active[going], calc_cell[going], move_card[going]
+            source = pos[board_ix, move_card]
+            cells[board_ix, target] = move_card
+            cells[board_ix, source] = EMPTY
+            pos[board_ix, move_card] = target
+            calc[board_ix] = source
+            line_len[board_ix, space_index] += 1
+            active = board_ix
+
+    return line_len, line_len.sum(axis=1)
+
+
+def child_boards(boards: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Make every move on every board, returns (parent index, from cell, to cell, child boards)
+
+    Children come parent by parent in the order expand_tree makes the
+    moves, and child boards are (M, 4, 14) like the boards.
+    """
+    cells = boards.reshape(-1, NUM_CELLS)
+    moves = legal_moves(boards)
+    parent_index, space_index, move_index = np.nonzero(moves >= 0)
+    from_cells = moves[parent_index, space_index, move_index]
+    to_cells = space_cells(cells)[parent_index, space_index]
+    children = cells[parent_index]
+    child_ix = np.arange(len(children))
+    children[child_ix, to_cells] = children[child_ix, from_cells]
+    children[child_ix, from_cells] = EMPTY
+    return parent_index, from_cells, to_cells, children.reshape(-1, NUM_ROWS, ROW_LEN)
+
+
+def canonical_boards(boards: np.ndarray) -> np.ndarray:
+    """ Return boards with their rows sorted, as GameState.canonical_cells """
+    grid = boards.reshape(-1, NUM_ROWS, ROW_LEN)
+    # Cards fit in 6 bits, so each half row packs into a key that sorts as the bytes do
+    weights = np.uint64(64) ** np.arange(ROW_LEN // 2 - 1, -1, -1, dtype=np.uint64)
+    high = (grid[:, :, :ROW_LEN // 2].astype(np.uint64) * weights).sum(axis=2)
+    low = (grid[:, :, ROW_LEN // 2:].astype(np.uint64) * weights).sum(axis=2)
+    order = np.lexsort((low, high), axis=1)
+    return np.take_along_axis(grid, order[:, :, None], axis=1)
+
+
+def zobrist_keys(boards: np.ndarray) -> np.ndarray:
+    """ Return the (N,) uint64 Zobrist keys, as cells_hash """
+    cells = boards.reshape(-1, NUM_CELLS).astype(np.intp)
+    return np.bitwise_xor.reduce(ZOBRIST_TABLE[np.arange(NUM_CELLS), cells], axis=1)
+
+
+def score_upper_bound(boards: np.ndarray) -> np.ndarray:
+    """
+    Return the (N,) score upper bounds, as GameState.score_upper_bound
+
+    The cards that can move some day are found for all boards at once by
+    pulling forward from the cards before them: a card can move if it is
+    next into a space, is an open ace with a space in the first column, or
+    the card before it, or the card right of that, can move.
+    """
+    cells = boards.reshape(-1, NUM_CELLS).astype(np.intp)
+    count = len(cells)
+    rows = np.arange(count)[:, None]
+    grid = cells.reshape(count, NUM_ROWS, ROW_LEN)
+    pos = positions(cells).astype(np.intp)
+
+    # Cards in sequence never move, the next card of each suit decides its row
+    aces = grid[:, :, 0]
+    has_ace = aces != EMPTY
+    in_sequence = (grid[:, :, 1:13] == aces[:, :, None] + np.arange(1, 13)) & has_ace[:, :, None]
+    run = np.cumprod(in_sequence, axis=2).sum(axis=2)
+    is_target = has_ace & (run < 12)
+    targets = np.where(is_target, aces + run + 1, EMPTY)
+
+    # Cards with a space to move into
+    spaces = space_cells(cells)
+    seeds = np.zeros((count, NUM_CARDS + 1), dtype=bool)
+    seeds[rows, np.where(COL[spaces] > 0, NEXT[cells[rows, np.maximum(spaces - 1, 0)]], EMPTY)] = True
+    open_aces = IS_ACE[:NUM_CARDS] & (COL[pos[:, :NUM_CARDS]] > 0)
+    seeds[:, :NUM_CARDS] |= open_aces & (COL[spaces] == 0).any(axis=1)[:, None]
+    seeds[:, EMPTY] = False
+
+    # A card also moves if the card before it, or the card right of that one, moves
+    prev_pos = pos[:, np.maximum(PREV, 0)]
+    right_of_prev = np.where((PREV != EMPTY) & (COL[prev_pos] < ROW_LEN - 1),
+                             cells[rows, np.minimum(prev_pos + 1, NUM_CELLS - 1)], EMPTY)
+    movable = seeds.copy()
+    while True:
+        spread = seeds.copy()
+        spread[:, :NUM_CARDS] |= movable[:, PREV] | movable[rows, right_of_prev]
+        if (spread == movable).all():
+            break
+        movable = spread
+
+    all_targets = (~is_target | movable[rows, targets]).all(axis=1)
+
+    # A row cannot grow past a card it needs that never moves, or a wrong card in its way that never moves
+    need = np.minimum(aces[:, :, None] + np.arange(1, 13), EMPTY)
+    card = grid[:, :, 1:13]
+    flat_rows = np.arange(count)[:, None, None]
+    grows = (card == need) | (((card == EMPTY) | movable[flat_rows, card]) & movable[flat_rows, need])
+    row_bound = np.where(has_ace, np.cumprod(grows, axis=2).sum(axis=2), 12)
+    return np.where(all_targets, 48, row_bound.sum(axis=1))
+
+
+def evaluate(boards: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Evaluate boards in bulk, with the columns expand_tree stores per state.
+
+    Returns arrays keyed score, game_over, active_spaces, tot_line_len and
+    line_len_val.
+    """
+    score = calculate_score(boards)
+    line_len, tot_line_len = calc_line_len(boards)
+    line_len_val = np.where(score < 48, (tot_line_len + score) / np.maximum(48.0 - score, 1.0), 0.0)
+    return {
+        'score': score,
+        'game_over': is_game_over(boards),
+        'active_spaces': (line_len > 0).sum(axis=1),
+        'tot_line_len': tot_line_len,
+        'line_len_val': line_len_val,
+    }
+
@@ -0,0 +1,220 @@
+# SpacesAces - Batch solver running many deals in parallel for win rate statistics
+# Copyright (C) 2024 John Barron <jbarronuk@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import csv
+import math
+import multiprocessing
+import os
+import random
+import re
+import sys
+import time
+from typing import List, Optional, Tuple
+
+from gamestate import GameState, CARD_ID, NUM_ROWS, ROW_LEN
+from solver import solve
+
+DEFAULT_MAX_NODES = 100000
+
+# Outcome of a deal: solved, searched to the end without a solution, or stopped by its budget
+SOLVED = 'solved'
+UNSOLVABLE = 'unsolvable'
+UNDECIDED = 'undecided'
+
+# Colour codes in tracestate output
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def parse_numbers(text: str) -> List[int]:
+    """
+    Parse a list of numbers such as 0-999 or 1,5,10-20
+
+    @filename reads the numbers from a file, separated by commas or whitespace.
+    """
+    if text.startswith('@'):
+        with open(text[1:], 'r') as f:
+            text = ','.join(f.read().split())
+    numbers = []
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        numbers.extend(range(int(first), int(last or first) + 1))
+    return numbers
+
+
+def read_board_file(filename: str) -> str:
+    """
+    Return the first board in a file as save_game text
+
+    Works for save_game boards and for tracestate traces, whose first board
+    is the start state.
+    """
+    rows = []
+    with open(filename, 'r') as f:
+        for line in f:
+            cards = ANSI_ESCAPE.sub('', line).split()
+            if len(cards) == ROW_LEN and all(card_str in CARD_ID for card_str in cards):
+                rows.append(' '.join(cards))
+                if len(rows) == NUM_ROWS:
+                    return '\n'.join(rows)
+            else:
+                rows = []
+    raise ValueError(f"No board found in {filename}")
+
+
+def deal_board(source: str, value) -> str:
+    """ Return the board for a deal number, a random seed or a board file """
+    if source == 'deal':
+        return GameState.from_deal(value).save_game()
+    if source == 'seed':
+        random.seed(value)
+        return GameState().save_game()
+    return read_board_file(value)
+
+
+def deal_status(result) -> str:
+    """ Return SOLVED, UNSOLVABLE or UNDECIDED for a SolveResult """
+    if result.solved:
+        return SOLVED
+    # The bound only prunes lines that cannot reach 48, so a finished search proves there is no solution
+    return UNDECIDED if result.checkpoint else UNSOLVABLE
+
+
+def solve_job(job: Tuple[str, object, Optional[int], Optional[float]]) -> tuple:
+    """
+    Solve one (source, value, max_nodes, max_seconds) job in a worker process
+
+    Returns (source, value, SolveResult, status, error). The result comes
+    back without its checkpoint, which would only be pickled back to be
+    thrown away, so status records whether the search was finished.
+    """
+    source, value, max_nodes, max_seconds = job
+    try:
+        result = solve(deal_board(source, value), max_nodes, max_seconds)
+    except (OSError, ValueError) as e:
+        return source, value, None, None, str(e)
+    return source, value, result._replace(checkpoint=None), deal_status(result), None
+
+
+def wilson_interval(wins: int, games: int, z: float = 1.96) -> Tuple[float, float]:
+    """ Return the Wilson score interval of a win rate, 95% by default """
+    if games == 0:
+        return 0.0, 0.0
+    rate = wins / games
+    denominator = 1 + z * z / games
+    centre = (rate + z * z / (2 * games)) / denominator
+    half_width = z * math.sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / denominator
+    return centre - half_width, centre + half_width
+
+
+def print_summary(results: list, statuses: list, wall_seconds: float) -> None:
+    """
+    Print the win rate and score statistics of a run
+
+    The win rate and its interval are over the decided deals, solved or
+    proven unsolvable. Deals stopped by the budget could go either way, so
+    over all deals only a lower bound on the win rate is known.
+    """
+    games = len(results)
+    if not games:
+        print("No deals solved")
+        return
+    wins = statuses.count(SOLVED)
+    losses = statuses.count(UNSOLVABLE)
+    decided = wins + losses
+    print(f"\nDeals: {games} Solved: {wins} Unsolvable: {losses} Undecided (budget reached): {games - decided}")
+    if decided:
+        low, high = wilson_interval(wins, decided)
+        print(f"Win rate of decided deals: {100.0 * wins / decided:.1f}% "
+              f"(95% CI {100.0 * low:.1f}% - {100.0 * high:.1f}%)")
+    else:
+        print("Win rate of decided deals: no deal decided, raise the budget")
+    if decided < games:
+        low, _ = wilson_interval(wins, games)
+        print(f"Win rate of all deals: at least {100.0 * wins / games:.1f}% "
+              f"(95% lower bound {100.0 * low:.1f}%)")
+    scores = sorted(result.score for result in results)
+    print(f"Best score mean: {sum(scores) / games:.2f} median: {scores[games // 2]} "
+          f"min: {scores[0]} max: {scores[-1]}")
+    print(f"Nodes: {sum(result.nodes for result in results)} "
+          f"Solver time: {sum(result.seconds for result in results):.2f} seconds "
+          f"Wall time: {wall_seconds:.2f} seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve many deals across all cores and report win rate statistics.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--deals', help="deal numbers, e.g. 0-999, 1,5,10-20 or @file")
+    source.add_argument('--boards', metavar='DIR', help="directory of board or trace .txt files")
+    source.add_argument('--seeds', help="random seeds dealt by GameState(), e.g. 1-100 or @file")
+    parser.add_argument('--nodes', type=int, default=DEFAULT_MAX_NODES,
+                        help=f"node budget per deal, 0 for none (default {DEFAULT_MAX_NODES})")
+    parser.add_argument('--seconds', type=float, help="time budget per deal in seconds")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="worker processes (default all cores)")
+    parser.add_argument('--csv', metavar='FILE', help="write the per-deal results to a CSV file")
+    args = parser.parse_args()
+
+    if args.deals:
+        jobs = [('deal', deal_number) for deal_number in parse_numbers(args.deals)]
+    elif args.seeds:
+        jobs = [('seed', seed) for seed in parse_numbers(args.seeds)]
+    else:
+        jobs = [('file', os.path.join(args.boards, filename))
+                for filename in sorted(os.listdir(args.boards)) if filename.endswith('.txt')]
+    jobs = [(source, value, args.nodes or None, args.seconds) for source, value in jobs]
+    print(f"Solving {len(jobs)} deals with {args.workers} workers")
+
+    csv_file = open(args.csv, 'w', newline='') if args.csv else None
+    writer = csv.writer(csv_file) if csv_file else None
+    if writer:
+        writer.writerow(['Source', 'Deal', 'Status', 'Score', 'Moves', 'Nodes', 'Seconds'])
+
+    results = []
+    statuses = []
+    start_time = time.time()
+    pool = multiprocessing.Pool(args.workers)
+    try:
+        # Results come back in job order, each deal is one task
+        for source, value, result, status, error in pool.imap(solve_job, jobs, chunksize=1):
+            label = os.path.basename(value) if source == 'file' else value
+            if error:
+                print(f"{source} {label}: {error}", file=sys.stderr)
+                continue
+            results.append(result)
+            statuses.append(status)
+            print(f"{source} {label}: {status} best {result.score} "
+                  f"moves {len(result.moves)} nodes {result.nodes} time {result.seconds:.2f}")
+            if writer:
+                writer.writerow([source, label, status, result.score, len(result.moves),
+                                 result.nodes, f"{result.seconds:.3f}"])
+        pool.close()
+    except KeyboardInterrupt:
+        print("\nStopped, summary of the deals finished so far")
+        pool.terminate()
+    finally:
+        pool.join()
+        if csv_file:
+            csv_file.close()
+
+    print_summary(results, statuses, time.time() - start_time)
+
+
+if __name__ == "__main__":
+    main()
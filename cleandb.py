@@ -19,46 +19,28 @@ import os
 import sqlite3
 import time
 
+from shards import resolve_db_path
+from statestore import ask_store_kind, open_store, store_path
+
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
-def clean_state_history(db_path, start_state_id):
-    conn = None
+def clean_state_history(store, start_state_id, can_vacuum=True):
     highest_score_state = None
     print(f"\nBeginning clean for start state {start_state_id}")
 
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        # Acquire an exclusive lock on the database
-        cursor.execute("BEGIN EXCLUSIVE TRANSACTION")
-
         start_time = time.time()
 
         # Find the state with the highest score for the given start state
-        cursor.execute("""
-                SELECT GameState, Score, DepthLvl
-                FROM GameTree
-                WHERE StartState = ?
-                ORDER BY Score DESC, DepthLvl 
-            """, (start_state_id,))
-        highest_score_state, highest_score, depth = cursor.fetchone()
-
-        # Delete all moves related to this start state
-        cursor.execute("DELETE FROM Moves WHERE StartState = ?", (start_state_id,))
-        deleted_moves = cursor.rowcount
-
-        # Delete all game states except the start state and highest score state
-        cursor.execute("""
-                DELETE FROM GameTree
-                WHERE StartState = ?
-                AND GameState NOT IN (?, ?)
-            """, (start_state_id, start_state_id, highest_score_state))
-        deleted_states = cursor.rowcount
-
-        # Commit the transaction
-        conn.commit()
+        best = store.best_state(start_state_id)
+        if best is None:
+            print(f"No states found for start state {start_state_id}")
+            return None
+        highest_score_state, highest_score, depth = best.state_id, best.score, best.depth
+
+        # Delete all moves and all game states except the start state and highest score state
+        deleted_states, deleted_moves = store.clean(start_state_id, {start_state_id, highest_score_state})
 
         end_time = time.time()
         operation_time = end_time - start_time
@@ -71,21 +53,18 @@ def clean_state_history(db_path, start_state_id):
         print(f"Operation took {operation_time:.2f} seconds")
 
         # Prompt for VACUUM operation
-        vacuum_choice = input("\nDo you want to perform a VACUUM operation to compact the database? (Y/N): ").lower()
-        if vacuum_choice == 'y':
-            vacuum_start_time = time.time()
-            conn.execute("VACUUM")
-            vacuum_end_time = time.time()
-            vacuum_time = vacuum_end_time - vacuum_start_time
-            print(f"VACUUM operation completed in {vacuum_time:.2f} seconds")
-
-    except sqlite3.Error as e:
-        if conn:
-            conn.rollback()
+        if can_vacuum:
+            vacuum_choice = input("\nDo you want to perform a VACUUM operation to compact the database? (Y/N): ").lower()
+            if vacuum_choice == 'y':
+                vacuum_start_time = time.time()
+                store.vacuum()
+                vacuum_end_time = time.time()
+                vacuum_time = vacuum_end_time - vacuum_start_time
+                print(f"VACUUM operation completed in {vacuum_time:.2f} seconds")
+
+    except (OSError, sqlite3.Error) as e:
+        store.rollback()
         print(f"An error occurred: {e}")
-    finally:
-        if conn:
-            conn.close()
 
     return highest_score_state
 
@@ -94,6 +73,8 @@ def main():
 
     clear_screen()
     print(f"Database path: {db_path}")
+    store_kind = ask_store_kind()
+    use_shards = store_kind == 'sqlite' and input("Clean in shard files Y or N?: ").strip().lower() == 'y'
 
     while True:
         print("\nBacking up your database before cleaning is recommended")
@@ -104,14 +85,28 @@ def main():
         clear_screen()
         try:
             state_id = int(state_id)
+        except ValueError:
+            print("Please enter a valid integer state ID.")
+            continue
 
-            highest_score_state = clean_state_history(db_path, state_id)
+        try:
+            if store_kind == 'sqlite':
+                path = resolve_db_path(db_path, state_id, use_shards)
+            else:
+                path = store_path(store_kind, db_path)
+            store = open_store(store_kind, path)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Error opening state store: {e}")
+            continue
 
-            print(f"\nCleaned state history for start state {state_id}")
-            print(f"Kept start state {state_id} and highest score state {highest_score_state}")
+        try:
+            # The log store has no free space to give back, clean rewrites its moves log
+            highest_score_state = clean_state_history(store, state_id, can_vacuum=store_kind != 'log')
+        finally:
+            store.close()
 
-        except ValueError:
-            print("Please enter a valid integer state ID.")
+        print(f"\nCleaned state history for start state {state_id}")
+        print(f"Kept start state {state_id} and highest score state {highest_score_state}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
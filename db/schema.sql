@@ -24,8 +24,9 @@ CREATE TABLE "GameTree" (
 	"ActiveSpaces"	INTEGER NOT NULL,
 	"TotLineLen"	INTEGER NOT NULL,
 	"LineLenVal" 	REAL NOT NULL,	
-	"GameOver" 	 	CHAR(1) NOT NULL DEFAULT '0',
+	"GameOver" 	 	CHAR(1) NOT NULL DEFAULT '0',	-- '1' no moves left, '2' cannot beat the best score
     "DepthLvl"   	INTEGER NOT NULL,
+	"Expanded"		INTEGER NOT NULL DEFAULT 0,	-- 1 once the state's moves are stored
     PRIMARY KEY("GameState")
 );
 
@@ -33,6 +34,8 @@ CREATE INDEX idx_score ON GameTree(Score);
 CREATE INDEX idx_depth ON GameTree(DepthLvl);
 CREATE INDEX idx_start_state ON GameTree(StartState, GameState);
 CREATE UNIQUE INDEX idx_unique_board ON GameTree(StartState, Board);
+-- Unexpanded states still in play, so finding the frontier costs its size and not the tree's
+CREATE INDEX idx_frontier ON GameTree(StartState, LineLenVal, DepthLvl, Score) WHERE GameOver = '0' AND Expanded = 0;
 
 CREATE TABLE "Moves" (
     "StartState" 	INTEGER,
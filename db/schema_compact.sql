@@ -0,0 +1,62 @@
+-- SpacesAces - Compact SQL schema keyed by 64-bit board hashes
+-- Copyright (C) 2024 John Barron <jbarronuk@gmail.com>
+--
+-- This file is part of SpacesAces.
+--
+-- SpacesAces is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU General Public License as published by
+-- the Free Software Foundation, either version 3 of the License, or
+-- (at your option) any later version.
+--
+-- SpacesAces is distributed in the hope that it will be useful,
+-- but WITHOUT ANY WARRANTY; without even the implied warranty of
+-- MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+-- GNU General Public License for more details.
+--
+-- You should have received a copy of the GNU General Public License
+-- along with SpacesAces.  If not, see <https://www.gnu.org/licenses/>.
+
+-- Alternative to schema.sql for large trees. A state is identified by the
+-- Zobrist key of its board (GameState.key, or canonical_key for canonical
+-- boards) stored signed, see gamestate.signed_key, and the board itself is
+-- the 42 byte GameState.to_packed BLOB. Rows are clustered by start state
+-- in WITHOUT ROWID tables, so there is no separate rowid or board index.
+-- Migrated and vacuumed trees come out about 2.4 to 2.5 times smaller than
+-- with schema.sql (2.35x and 2.53x on the trees measured), short of the 3
+-- to 5 times hoped for. statestore.CompactStateStore reads and
+-- writes it, so analyze.py best-first and beam search, tracestate.py and
+-- cleandb.py run on it when the compact store is picked. A state's ID
+-- there is its StartKey and StateKey as unsigned 64-bit halves of one
+-- 128-bit number.
+
+CREATE TABLE "GameTree" (
+    "StartKey"      INTEGER NOT NULL,
+    "StateKey"      INTEGER NOT NULL,
+    "Board"         BLOB NOT NULL,
+    "Score"         INTEGER NOT NULL,
+    "ActiveSpaces"  INTEGER NOT NULL,
+    "TotLineLen"    INTEGER NOT NULL,
+    "LineLenVal"    REAL NOT NULL,
+    "GameOver"      INTEGER NOT NULL DEFAULT 0,    -- 1 no moves left, 2 cannot beat the best score
+    "DepthLvl"      INTEGER NOT NULL,
+    "Expanded"      INTEGER NOT NULL DEFAULT 0,    -- 1 once the state's moves are stored
+    PRIMARY KEY("StartKey", "StateKey")
+) WITHOUT ROWID;
+
+-- Unexpanded states still in play, so finding the frontier costs its size and not the tree's
+CREATE INDEX idx_frontier ON GameTree(StartKey, LineLenVal, DepthLvl, Score) WHERE GameOver = 0 AND Expanded = 0;
+
+-- Moves belong to a start state's tree like its states, so Expanded means the
+-- state's children are stored in that tree, and a move leads from the state
+-- with FromKey to the state with ToKey under the same StartKey.
+-- MoveFrom and MoveTo are board cells, row * 14 + col.
+CREATE TABLE "Moves" (
+    "StartKey"      INTEGER NOT NULL,
+    "FromKey"       INTEGER NOT NULL,
+    "ToKey"         INTEGER NOT NULL,
+    "MoveFrom"      INTEGER NOT NULL,
+    "MoveTo"        INTEGER NOT NULL,
+    PRIMARY KEY("StartKey", "FromKey", "ToKey")
+) WITHOUT ROWID;
+
+CREATE INDEX idx_tostate ON Moves(StartKey, ToKey, FromKey);
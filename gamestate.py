@@ -15,10 +15,145 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import random
-import copy
 from typing import Tuple, List, Dict, Optional
 from enum import Enum
 
+# Compact integer layout
+# Cards are ids 0..51: suit index * 13 + rank index, so an ace is a multiple
+# of 13 and the next card in sequence is always id + 1 (except after a King).
+# Board cells are 0..55: row * 14 + col.
+NUM_CARDS = 52
+NUM_ROWS = 4
+ROW_LEN = 14
+NUM_CELLS = NUM_ROWS * ROW_LEN
+EMPTY = NUM_CARDS  # Cell value for a space, also "no card" in lookup tables
+
+SUITS = ['H', 'D', 'C', 'S']
+RANKS = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '0', 'J', 'Q', 'K']
+
+# Lookup tables indexed by card id (with a trailing entry for EMPTY)
+CARD_RANK = bytes([card % 13 for card in range(NUM_CARDS)] + [EMPTY])
+CARD_SUIT = bytes([card // 13 for card in range(NUM_CARDS)] + [EMPTY])
+NEXT_CARD = bytes([card + 1 if card % 13 < 12 else EMPTY for card in range(NUM_CARDS)] + [EMPTY])
+CARD_TUPLE = [(RANKS[card % 13], SUITS[card // 13]) for card in range(NUM_CARDS)] + [None]
+CARD_NAME = [f"{rank}{suit}" for rank, suit in CARD_TUPLE[:NUM_CARDS]] + ['__']
+CARD_ID = {name: card for card, name in enumerate(CARD_NAME)}
+CARD_ID['__'] = EMPTY
+
+# Lookup tables indexed by cell
+CELL_ROW = bytes([cell // ROW_LEN for cell in range(NUM_CELLS)])
+CELL_COL = bytes([cell % ROW_LEN for cell in range(NUM_CELLS)])
+CELL_RC = [(cell // ROW_LEN, cell % ROW_LEN) for cell in range(NUM_CELLS)]
+
+# Zobrist keys indexed by cell * (NUM_CARDS + 1) + card, zero for EMPTY.
+# Fixed seed so keys are stable between runs and can be stored.
+ZOBRIST_STRIDE = NUM_CARDS + 1
+_zobrist_rng = random.Random(0x5ACE5ACE)
+ZOBRIST = [0 if card == EMPTY else _zobrist_rng.getrandbits(64)
+           for cell in range(NUM_CELLS) for card in range(ZOBRIST_STRIDE)]
+del _zobrist_rng
+
+
+# Numbered deals
+# Deal N shuffles with a splitmix64 generator seeded by N, so deals are the
+# same on every platform and Python version and can be split into ranges.
+MASK64 = (1 << 64) - 1
+
+
+def deal_cells(deal_number: int) -> bytearray:
+    """ Return the 56 board cells of numbered deal, cards from column 1 of each row """
+    if not 0 <= deal_number <= MASK64:
+        raise ValueError("Deal number must be a 64-bit unsigned integer")
+
+    # Fisher-Yates shuffle, the modulo bias is below 2**-57
+    deck = list(range(NUM_CARDS))
+    state = deal_number
+    for i in range(NUM_CARDS - 1, 0, -1):
+        state = (state + 0x9E3779B97F4A7C15) & MASK64
+        z = state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        j = (z ^ (z >> 31)) % (i + 1)
+        deck[i], deck[j] = deck[j], deck[i]
+
+    cells = bytearray([EMPTY]) * NUM_CELLS
+    for row in range(NUM_ROWS):
+        cells[row * ROW_LEN + 1:(row + 1) * ROW_LEN] = bytes(deck[row * 13:(row + 1) * 13])
+    return cells
+
+
+def deal_block(first_deal: int, count: int) -> bytearray:
+    """ Return deals first_deal to first_deal + count - 1 as consecutive 56 byte boards """
+    block = bytearray()
+    for deal_number in range(first_deal, first_deal + count):
+        block += deal_cells(deal_number)
+    return block
+
+
+def iter_deal_blocks(first_deal: int, count: int, block_size: int = 65536):
+    """ Yield (first deal number, block) pairs covering a deal range in bounded memory """
+    end_deal = first_deal + count
+    for block_start in range(first_deal, end_deal, block_size):
+        yield block_start, deal_block(block_start, min(block_size, end_deal - block_start))
+
+
+def cells_to_text(cells) -> str:
+    """ Format board cells as the whitespace separated text used by save_game """
+    return '\n'.join([' '.join([CARD_NAME[card] for card in cells[row_start:row_start + ROW_LEN]])
+                      for row_start in range(0, NUM_CELLS, ROW_LEN)])
+
+
+def cells_hash(cells) -> int:
+    """ Compute the Zobrist hash of board cells """
+    board_hash = 0
+    for cell, card in enumerate(cells):
+        board_hash ^= ZOBRIST[cell * ZOBRIST_STRIDE + card]
+    return board_hash
+
+
+# Packed boards hold each cell in 6 bits, 42 bytes for the whole board
+CELL_BITS = 6
+PACKED_LEN = NUM_CELLS * CELL_BITS // 8
+
+
+def pack_cells(cells) -> bytes:
+    """ Pack board cells into PACKED_LEN bytes, the first cell in the lowest bits """
+    packed = 0
+    for card in reversed(cells):
+        packed = packed << CELL_BITS | card
+    return packed.to_bytes(PACKED_LEN, 'little')
+
+
+def unpack_cells(data: bytes) -> bytearray:
+    """ Unpack board cells from pack_cells """
+    packed = int.from_bytes(data, 'little')
+    mask = (1 << CELL_BITS) - 1
+    return bytearray([packed >> (cell * CELL_BITS) & mask for cell in range(NUM_CELLS)])
+
+
+def signed_key(key: int) -> int:
+    """ Return a 64-bit hash as the signed integer SQLite can store """
+    return key - (1 << 64) if key >> 63 else key
+
+
+def moves_commute(move1: Tuple[int, int], move2: Tuple[int, int]) -> bool:
+    """
+    Check if two (from_cell, to_cell) moves can be made in either order.
+
+    The moves must touch four different cells, and neither may move the
+    card in front of the other's space or fill it.
+    """
+    from1, to1 = move1
+    from2, to2 = move2
+    if len({from1, to1, from2, to2}) < 4:
+        return False
+    if CELL_COL[to1] > 0 and to1 - 1 in (from2, to2):
+        return False
+    if CELL_COL[to2] > 0 and to2 - 1 in (from1, to1):
+        return False
+    return True
+
+
 class ColorMode(Enum):
     DARK = "dark"
     LIGHT = "light"
@@ -29,14 +164,19 @@ class GameState:
     Manages the state and rules of a Spaces and Aces Solitaire game.
 
     Key components:
-    - board: 2D list representing the game layout
-    - spaces: List of empty space positions
-    - moves: Available moves for each space
-    - aces: Positions of aces on the board
+    - cells: 56 byte board of card ids, EMPTY for spaces
+    - pos: Cell of each card id, the inverse of cells
+    - space_cells: Cells of the four empty spaces
+    - move_cells: Source cells of the available moves for each space
+    - ace_cells: Cells of aces not yet moved to the first column
+    - zobrist: 64-bit hash of the board, kept up to date by make_move
+
+    The board, spaces, moves, aces and card_locations properties give the
+    same (row, col) and (rank, suit) views as before for display and callers.
     """
 
-    suits = ['H', 'D', 'C', 'S']
-    ranks = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '0', 'J', 'Q', 'K']
+    suits = SUITS
+    ranks = RANKS
 
     def set_color_mode(self, mode):
         if isinstance(mode, ColorMode):
@@ -44,230 +184,431 @@ class GameState:
         else:
             raise ValueError("mode must be a ColorMode enum")
 
+    @property
+    def board(self) -> List[List[Optional[Tuple[str, str]]]]:
+        cells = self.cells
+        return [[CARD_TUPLE[card] for card in cells[row:row + ROW_LEN]]
+                for row in range(0, NUM_CELLS, ROW_LEN)]
+
+    @property
+    def spaces(self) -> List[Tuple[int, int]]:
+        return [CELL_RC[cell] for cell in self.space_cells]
+
+    @property
+    def moves(self) -> List[Optional[List[Tuple[int, int]]]]:
+        return [None if moves is None else [CELL_RC[cell] for cell in moves]
+                for moves in self.move_cells]
+
+    @property
+    def aces(self) -> List[Tuple[int, int]]:
+        return [CELL_RC[cell] for cell in self.ace_cells]
+
+    @property
+    def card_locations(self) -> Dict[Tuple[str, str], Tuple[int, int]]:
+        return {CARD_TUPLE[card]: CELL_RC[cell] for card, cell in enumerate(self.pos)}
+
     def calc_line_len(self) -> None:
         """ Calculate maximum moves down the line of each space to block """
-        self.num_moves = sum(1 for moves in self.moves if moves)
+        self.num_moves = sum(1 for moves in self.move_cells if moves)
         self.line_len = [0, 0, 0, 0]
         self.tot_line_len = 0
 
+        # Moves are applied to this state and rolled back after each line
+        cells = self.cells
+        spaces = self.space_cells
+        moves = self.move_cells
+        undo_stack = []
+
         # Loop through the four possible moves
         for space_index in range(4):
-            # Deep copy current game state
-            calc_game = copy.deepcopy(self)
-            # check for spaces to the left of the current line
-            (calc_row, calc_col) = calc_game.spaces[space_index]
+            calc_cell = spaces[space_index]
 
             # Apply moves from here on in
             while True:
                 # ignore foundation spaces
-                if calc_col == 0:
+                row_start = calc_cell - CELL_COL[calc_cell]
+                if calc_cell == row_start:
                     break
                 else:
                     # if spaces to the left, track back to the first available move if any
-                    temp_col = calc_col
-                    temp_card = calc_game.board[calc_row][temp_col - 1]
-                    while (not temp_card
-                           and temp_col > 0):
-                        temp_index = calc_game.spaces.index((calc_row, temp_col))
-                        if temp_index is not None:
-                            temp_col -= 1
-                            temp_card = calc_game.board[calc_row][temp_col]
+                    temp_cell = calc_cell
+                    temp_card = cells[temp_cell - 1]
+                    while (temp_card == EMPTY
+                           and temp_cell > row_start):
+                        temp_cell -= 1
+                        temp_card = cells[temp_cell]
                     # Break on blocking King found
-                    if temp_card:
-                        # temp_card cannot be None here
-                        if temp_card[0] == 'K':
-                            temp_col = 0
+                    if temp_card != EMPTY:
+                        if NEXT_CARD[temp_card] == EMPTY:
                             break
                         else:
-                            temp_col += 1
+                            temp_cell += 1
                     else:
                         break
 
-                   # apply preceding moves if need be
-                    while (temp_card
-                            and temp_col < calc_col):
-                        temp_index = calc_game.spaces.index((calc_row, temp_col))
+                    # apply preceding moves if need be
+                    while temp_cell < calc_cell:
+                        temp_index = spaces.index(temp_cell)
                         # only make move if it's possible
-                        temp2 = calc_game.moves[temp_index]
-                        if temp2:
-                            calc_game.make_move(temp_index, 0)
-                            temp_col += 1
+                        if moves[temp_index]:
+                            undo_stack.append(self.make_move(temp_index, 0))
+                            temp_cell += 1
                         else:
                             break
 
-                 # Apply move
-                if calc_game.moves[space_index]:
-                    calc_game.make_move(space_index, 0)
-                    (calc_row, calc_col) = calc_game.spaces[space_index]
+                # Apply move
+                if moves[space_index]:
+                    undo_stack.append(self.make_move(space_index, 0))
+                    calc_cell = spaces[space_index]
                     self.line_len[space_index] += 1
                     self.tot_line_len += 1
                 else:
                     break
 
-    def make_move(self, space_index: int, move_index: int) -> None:
-        """Execute a move in the game."""
+            # Restore the state for the next line
+            while undo_stack:
+                self.unmake_move(undo_stack.pop())
+
+    def make_move(self, space_index: int, move_index: int) -> tuple:
+        """
+        Execute a move in the game.
+
+        Returns an undo record for unmake_move, so search code can apply and
+        roll back moves on one state instead of copying or reloading it.
+        """
         # Raise error if no move available
-        if self.moves[space_index][move_index] is None:
+        moves = self.move_cells[space_index]
+        if not moves or move_index >= len(moves):
             raise TypeError("No move available")
 
-        # Get the source and target positions from spaces and moves
-        space_row, space_col = self.spaces[space_index]
-        source_row, source_col = self.moves[space_index][move_index]
-        move_card = self.board[source_row][source_col]
+        # Get the source and target cells from spaces and moves
+        space_cell = self.space_cells[space_index]
+        source_cell = moves[move_index]
+        move_card = self.cells[source_cell]
 
         # Move the card
-        self.board[space_row][space_col] = self.board[source_row][source_col]
-        self.board[source_row][source_col] = None
+        self.cells[space_cell] = move_card
+        self.cells[source_cell] = EMPTY
+        self.pos[move_card] = space_cell
+        self.zobrist ^= (ZOBRIST[space_cell * ZOBRIST_STRIDE + move_card]
+                         ^ ZOBRIST[source_cell * ZOBRIST_STRIDE + move_card])
 
-        self.spaces[space_index] = (source_row, source_col)  # Update empty space location
-        self.card_locations[move_card] = (space_row, space_col)
+        self.space_cells[space_index] = source_cell  # Update empty space location
 
         # If ace was moved, remove it from the open aces list
-        if move_card[0] == 'A':
-            self.aces.remove((source_row, source_col))
-
-        for i in range(4):
-            self.update_moves(i)
+        ace_index = None
+        ace_moved = CARD_RANK[move_card] == 0
+        if ace_moved:
+            ace_index = self.ace_cells.index(source_cell)
+            del self.ace_cells[ace_index]
+
+        undo = (space_index, space_cell, source_cell, ace_index, self.move_cells.copy())
+
+        # Only the moved space, spaces to the right of the two changed cells
+        # and, after an ace move, the first column spaces can have new moves.
+        # No other space can target the moved card, its predecessor was left of the target.
+        for i, check_cell in enumerate(self.space_cells):
+            if (i == space_index
+                    or check_cell - 1 == space_cell
+                    or check_cell - 1 == source_cell
+                    or (ace_moved and CELL_COL[check_cell] == 0)):
+                self.update_moves(i)
+
+        return undo
+
+    def unmake_move(self, undo: tuple) -> None:
+        """ Reverse a move using the record returned by make_move """
+        space_index, space_cell, source_cell, ace_index, moves = undo
+        move_card = self.cells[space_cell]
+
+        # Move the card back
+        self.cells[source_cell] = move_card
+        self.cells[space_cell] = EMPTY
+        self.pos[move_card] = source_cell
+        self.zobrist ^= (ZOBRIST[space_cell * ZOBRIST_STRIDE + move_card]
+                         ^ ZOBRIST[source_cell * ZOBRIST_STRIDE + move_card])
+
+        self.space_cells[space_index] = space_cell
+
+        # Put a moved ace back in its original place in the aces list
+        if ace_index is not None:
+            self.ace_cells.insert(ace_index, source_cell)
+
+        # Move lists are replaced, never changed in place, so the saved ones are still valid
+        self.move_cells[:] = moves
 
     def update_moves(self, check_index: int) -> None:
         """ Reconstruct available moves for each space """
-        check_row, check_col = self.spaces[check_index]
+        check_cell = self.space_cells[check_index]
 
         # moves are already set if it's an initial space
-        if check_col == 0:
-            self.moves[check_index] = self.aces.copy()
+        if CELL_COL[check_cell] == 0:
+            self.move_cells[check_index] = self.ace_cells.copy()
 
         else:
-            # Find potential new move
-            self.moves[check_index] = None
-            next_card = None
-            prev_card = self.board[check_row][check_col - 1]
-
-            if prev_card is not None: # Space to the left
-                next_rank_ix = self.ranks.index(prev_card[0]) + 1  # Index of next rank
-                if next_rank_ix < len(self.ranks): # Cannot go past King
-                    next_card = (self.ranks[next_rank_ix], prev_card[1])  # Rank, suit
-                    self.moves[check_index] = self.find_card(next_card)
+            # Find potential new move, cannot go past King or follow a space
+            next_card = NEXT_CARD[self.cells[check_cell - 1]]
+            if next_card == EMPTY:
+                self.move_cells[check_index] = None
+            else:
+                self.move_cells[check_index] = [self.pos[next_card]]
+
+    def key(self) -> int:
+        """ Return the 64-bit Zobrist hash identifying this board """
+        return self.zobrist
+
+    def board_hash(self) -> int:
+        """ Compute the Zobrist hash of the board from scratch """
+        return cells_hash(self.cells)
+
+    def canonical_cells(self) -> bytes:
+        """
+        Return the board with its rows sorted, the representative of all row permutations.
+
+        The rules never refer to a row by number, so any reordering of the rows
+        is an equivalent position with the same score and moves.
+        """
+        cells = bytes(self.cells)
+        return b''.join(sorted([cells[row_start:row_start + ROW_LEN]
+                                for row_start in range(0, NUM_CELLS, ROW_LEN)]))
+
+    def canonical_board(self) -> str:
+        """ Return the canonical board as save_game text """
+        return cells_to_text(self.canonical_cells())
+
+    def canonical_key(self) -> int:
+        """ Return the Zobrist hash of the canonical board, shared by all row permutations """
+        return cells_hash(self.canonical_cells())
+
+    def sleep_set(self, last_moves: List[Tuple[int, int]]) -> set:
+        """
+        Return the (from_cell, to_cell) moves that need not be made next.
+
+        last_moves are the moves that reached this state. A move that sorts
+        before and commutes with every one of them reaches the same state in
+        the other order, from the parent, so only that order is searched.
+        Returns no moves if a last move does not fit this board.
+        """
+        cells = self.cells
+        for from_cell, to_cell in last_moves:
+            card = cells[to_cell]
+            if card == EMPTY or cells[from_cell] != EMPTY:
+                return set()
+            if CARD_RANK[card] == 0:
+                fits = CELL_COL[to_cell] == 0
+            else:
+                fits = CELL_COL[to_cell] > 0 and cells[to_cell - 1] == card - 1
+            if not fits:
+                return set()
+
+        sleep = set()
+        if last_moves:
+            for space_index, moves in enumerate(self.move_cells):
+                if moves:
+                    to_cell = self.space_cells[space_index]
+                    for from_cell in moves:
+                        move = (from_cell, to_cell)
+                        if all(move < last_move and moves_commute(move, last_move) for last_move in last_moves):
+                            sleep.add(move)
+        return sleep
+
+    def score_upper_bound(self) -> int:
+        """
+        Return an upper bound on the score reachable from this state.
+
+        A card only moves into the space right of the card before it, so it
+        can move some day only if that cell is a space, or the card before it
+        or the card in that cell can move some day. Open aces can always
+        move. A row cannot grow past a card it needs that never moves, or
+        past a wrong card in its way that never moves.
+        """
+        cells = self.cells
+        pos = self.pos
+
+        # Cards in sequence never move, the next card of each suit decides its row
+        movable = bytearray(NUM_CARDS + 1)
+        targets = 0
+        for row_start in range(0, NUM_CELLS, ROW_LEN):
+            ace = cells[row_start]
+            if ace != EMPTY:
+                col = 1
+                while col < 13 and cells[row_start + col] == ace + col:
+                    col += 1
+                if col < 13:
+                    movable[ace + col] = 2
+                    targets += 1
+        if not targets:
+            return 48
+
+        # Spread from the cards with a space to move into, until every target can move
+        movable[EMPTY] = 1
+        work = []
+        for space_cell in self.space_cells:
+            if CELL_COL[space_cell] > 0:
+                work.append(NEXT_CARD[cells[space_cell - 1]])
+            else:
+                work.extend(cells[ace_cell] for ace_cell in self.ace_cells)
+        while work:
+            card = work.pop()
+            if movable[card] == 1:
+                continue
+            if movable[card] == 2:
+                targets -= 1
+                if not targets:
+                    return 48
+            movable[card] = 1
+            work.append(NEXT_CARD[card])
+            cell = pos[card]
+            if CELL_COL[cell] > 0:
+                work.append(NEXT_CARD[cells[cell - 1]])
+
+        bound = 0
+        for row_start in range(0, NUM_CELLS, ROW_LEN):
+            ace = cells[row_start]
+            if ace == EMPTY:
+                # Any open ace could still be placed here
+                bound += 12
+                continue
+            col = 1
+            while col < 13:
+                need = ace + col
+                card = cells[row_start + col]
+                if card != need and ((card != EMPTY and movable[card] != 1) or movable[need] != 1):
+                    break
+                col += 1
+            bound += col - 1
+        return bound
 
     def is_game_over(self) -> bool :
         """Check if there are any available moves"""
-        for moves in self.moves:
+        for moves in self.move_cells:
             if moves:
                 return False
         return True
 
     def calculate_score(self) -> int:
         """Return the current game score."""
+        cells = self.cells
         total_cards = 0
-        for row in range(4):
-            in_sequence = 0
-            ace = self.board[row][0]
-            if ace:
-                ace_suit = ace[1]
-                for col in range(1, 14):
-                    card = self.board[row][col]
-                    if card:
-                        rank = card[0]
-                        suit = card[1]
-                        if (suit == ace_suit
-                        and col == self.ranks.index(rank)):
-                            in_sequence += 1
-                        else:
-                            break
-                    else:
+        for row_start in range(0, NUM_CELLS, ROW_LEN):
+            ace = cells[row_start]
+            if ace != EMPTY:
+                # In sequence cards are the ace id plus the column, up to King
+                for col in range(1, 13):
+                    if cells[row_start + col] != ace + col:
                         break
-            total_cards += in_sequence
+                    total_cards += 1
         return total_cards
 
-    def __init__(self):
+    def __init__(self, cells: Optional[bytes] = None):
+        """
+        Deal a new random game, or set up the game from 56 board cells.
+
+        Passing cells skips dealing, for boards loaded from text or bytes.
+        """
         self.color_mode = ColorMode.LIGHT  # Default to light mode
 
-        # Create a standard deck of cards
-        self.deck = [(rank, suit) for suit in self.suits for rank in self.ranks]
-        random.shuffle(self.deck)
+        if cells is None:
+            # Create a standard deck of cards
+            deck = list(range(NUM_CARDS))
+            random.shuffle(deck)
+
+            # Deal cards to the board, initial spaces in column zero
+            cells = bytearray([EMPTY]) * NUM_CELLS
+            for row in range(4):
+                for col in range(1, 14): # Start dealing from column 1
+                    cells[row * ROW_LEN + col] = deck.pop()
+        elif len(cells) != NUM_CELLS:
+            raise ValueError(f"Board must have {NUM_CELLS} cells")
 
         # Initialize the game board
-        self.board = [[None] * 14 for _ in range(4)]
-        # Row, Col, initial space column zero
-        self.spaces = [(0, 0), (1, 0), (2, 0), (3, 0)]
-        self.moves = [[], [], [], []]
-        self.aces = []
+        self.cells = bytearray(cells)
+        self.pos = bytearray(NUM_CARDS)
+        self.space_cells = []
+        self.move_cells = [[], [], [], []]
+        self.ace_cells = []
         self.num_moves = 0
         self.line_len = [0, 0, 0, 0]
         self.tot_line_len = 0
-        self.card_locations = {}  # New dictionary to store card locations
+        self.deal_number = None  # Set by from_deal
+
+        for cell, card in enumerate(self.cells):
+            if card == EMPTY:
+                self.space_cells.append(cell)
+            else:
+                self.pos[card] = cell  # Store the location
+                if CARD_RANK[card] == 0 and CELL_COL[cell] > 0:
+                    self.ace_cells.append(cell)
 
-        # Deal cards to the board
-        for row in range(4):
-            for col in range(1, 14): # Start dealing from column 1
-                card = self.deck.pop()
-                self.card_locations[card] = (row, col)  # Store the location
-                if card[0] == 'A':
-                    self.aces.append((row, col))
-                self.board[row][col] = card
+        if len(self.space_cells) != 4:
+            raise ValueError("Board must have four spaces")
 
-        self.moves = [self.aces.copy() for _ in range(4)]
+        self.zobrist = self.board_hash()
 
-        # Build these during board initialization
-        # Find initial empty spaces
-        # self.empty_spaces = self.find_empty_spaces()
-        # Find initial aces
-        # self.aces = self.find_aces()
+        # Reconstruct moves
+        for i in range(4):
+            self.update_moves(i)
 
     def save_game(self, filename: Optional[str] = None) -> Optional[str]:
         """ Save game to a file """
-        board_str = ""
-        for row in self.board:
-            row_str = ' '.join(['__' if card is None else f"{card[0]}{card[1]}" for card in row])
-            board_str += row_str + '\n'
+        board_str = cells_to_text(self.cells)
 
         if filename:
             with open(filename, 'w') as f:
-                f.write(board_str)
+                f.write(board_str + '\n')
         else:
-            return board_str.strip()  # strip() removes the trailing newline
+            return board_str
 
     @classmethod
-    def load_game(cls, source=None):
-        game = cls()  # Create a new instance
-        game.board = []
-        game.spaces = []
-        game.moves = [[], [], [], []]
-        game.num_moves = 0
-        game.line_len = [0, 0, 0, 0]
-        game.tot_line_len = 0
-        game.aces = []
+    def from_deal(cls, deal_number: int):
+        """ Create numbered deal, the same board on every run """
+        game = cls(deal_cells(deal_number))
+        game.deal_number = deal_number
+        return game
+
+    def to_bytes(self) -> bytes:
+        """ Return the board as 56 bytes of card ids, 52 for a space """
+        return bytes(self.cells)
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """ Create a game from the to_bytes encoding """
+        return cls(data)
 
+    def to_packed(self) -> bytes:
+        """ Return the board packed 6 bits per cell, as stored in the compact schema """
+        return pack_cells(self.cells)
+
+    @classmethod
+    def from_packed(cls, data: bytes):
+        """ Create a game from the to_packed encoding """
+        return cls(unpack_cells(data))
+
+    @classmethod
+    def from_board(cls, board: str):
+        """ Create a game from save_game board text """
+        cells = bytearray()
+        for line in board.strip().split('\n'):
+            row = line.split()
+            if len(row) != ROW_LEN:
+                raise ValueError(f"Board rows must have {ROW_LEN} cards")
+            cells += bytes([CARD_ID[card_str] for card_str in row])
+        return cls(cells)
+
+    @classmethod
+    def load_game(cls, source=None):
         if source is None:
             raise ValueError("Either filename or board string must be provided")
 
         # If source is a string and doesn't end with .txt, assume it's a board string
         if isinstance(source, str) and not source.endswith('.txt'):
-            lines = source.strip().split('\n')
+            board = source
         else:
             # Assume it's a filename
             with open(source, 'r') as f:
-                lines = f.readlines()
-
-        for row_index, line in enumerate(lines):
-                row = []
-                for col_index, card_str in enumerate(line.strip().split()):
-                    if card_str == '__':
-                        card = None
-                        game.spaces.append((row_index, col_index))
-                    else:
-                        card = (card_str[0], card_str[1])
-                        game.card_locations[card] = (row_index, col_index)  # Store the location
-                        if card[0] == 'A' and col_index > 0:
-                            game.aces.append((row_index, col_index))
-                    row.append(card)
-                game.board.append(row)
-
-        # Reconstruct moves
-        for i in range(4):
-            game.update_moves(i)
+                board = f.read()
 
-        return game
+        return cls.from_board(board)
 
     def __str__(self):
         self.calc_line_len()
@@ -333,11 +674,11 @@ class GameState:
         return output
 
     def find_card(self, next_card):
+        """ Locate a (rank, suit) card through the position index """
         card_locn = []
-        for row in range(4):
-            for col in range(1,14):
-                card = self.board[row][col]
-                if card  == next_card:
-                    card_locn.append((row, col))
-                    return card_locn # Return as soon as watch found
+        card = CARD_ID.get(f"{next_card[0]}{next_card[1]}", EMPTY)
+        if card != EMPTY:
+            cell = self.pos[card]
+            if CELL_COL[cell] > 0:
+                card_locn.append(CELL_RC[cell])
         return card_locn
@@ -0,0 +1,400 @@
+# SpacesAces - Streaming, resumable migration of GameTree databases to a new schema
+# Copyright (C) 2024 John Barron <jbarronuk@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import os
+import sqlite3
+import time
+from typing import List, Optional, Tuple
+from urllib.request import pathname2url
+
+from gamestate import CARD_ID, ROW_LEN, cells_hash, pack_cells, unpack_cells, signed_key
+
+DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db')
+SCHEMAS = {
+    'compact': os.path.join(DB_DIR, 'schema_compact.sql'),
+    'full': os.path.join(DB_DIR, 'schema.sql'),
+}
+
+DEFAULT_CHUNK = 50000
+
+# Migration phases in order, the target's Migration table records the one reached
+PHASES = ['states', 'moves', 'indexes', 'verify', 'done']
+
+SOURCE_COLUMNS = "StartState, GameState, Board, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver, DepthLvl"
+
+
+def keys_path(target_path: str) -> str:
+    """ Return the side file mapping source GameState IDs to board keys for a compact migration """
+    return os.path.splitext(target_path)[0] + '_keys.db'
+
+
+def split_schema(schema_path: str) -> Tuple[List[str], List[str]]:
+    """ Return a schema's CREATE TABLE and CREATE INDEX statements apart, indexes are built after the copy """
+    with open(schema_path, 'r') as f:
+        lines = [line.split('--', 1)[0] for line in f]
+    statements = [statement.strip() for statement in ''.join(lines).split(';') if statement.strip()]
+    tables = [statement for statement in statements if 'INDEX' not in statement.split('(', 1)[0].upper()]
+    indexes = [statement for statement in statements if statement not in tables]
+    return tables, indexes
+
+
+def open_migration(source_path: str, target_path: str, schema: str) -> sqlite3.Connection:
+    """
+    Open the target database with the source, and for compact the key file, attached
+
+    Creates the target tables and the Migration progress table the first
+    time, and checks a resumed migration is to the same schema.
+    """
+    # A crash must not lose committed chunks, so the target keeps a real
+    # journal rather than the MEMORY one analyze uses for speed
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(target_path))}", uri=True)
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA cache_size=-1048576;")
+    conn.execute("ATTACH DATABASE ? AS source", (f"file:{pathname2url(os.path.abspath(source_path))}?mode=ro",))
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS Migration (
+        Phase       TEXT NOT NULL,
+        Schema      TEXT NOT NULL,
+        LastState   INTEGER,
+        LastTo      INTEGER,
+        States      INTEGER NOT NULL DEFAULT 0,
+        Moves       INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    row = conn.execute("SELECT Schema FROM Migration").fetchone()
+    if row is None:
+        tables, _ = split_schema(SCHEMAS[schema])
+        for statement in tables:
+            conn.execute(statement)
+        conn.execute("INSERT INTO Migration (Phase, Schema) VALUES ('states', ?)", (schema,))
+        conn.commit()
+    elif row[0] != schema:
+        conn.close()
+        raise ValueError(f"{target_path} is a migration to the {row[0]} schema")
+
+    if schema == 'compact':
+        conn.execute("ATTACH DATABASE ? AS keys", (keys_path(target_path),))
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS keys.StateKeys (
+            GameState   INTEGER PRIMARY KEY,
+            StartKey    INTEGER NOT NULL,
+            StateKey    INTEGER NOT NULL
+        )
+        """)
+        conn.commit()
+    return conn
+
+
+def board_cells(board: str) -> bytes:
+    """ Return the cells of save_game board text """
+    return bytes([CARD_ID[card_str] for card_str in board.split()])
+
+
+def source_expanded(conn: sqlite3.Connection) -> str:
+    """ Return the SQL for a source state's Expanded flag, from its moves if it predates the column """
+    columns = [row[1] for row in conn.execute("PRAGMA source.table_info(GameTree)")]
+    if 'Expanded' in columns:
+        return "source.GameTree.Expanded"
+    return "EXISTS (SELECT 1 FROM source.Moves WHERE FromState = source.GameTree.GameState)"
+
+
+def chunk_end(conn: sqlite3.Connection, last_state: int, chunk: int) -> Optional[int]:
+    """ Return the last source GameState of the chunk after last_state, None when there are no more """
+    row = conn.execute("""
+    SELECT MAX(GameState)
+    FROM (SELECT GameState
+          FROM source.GameTree
+          WHERE GameState > ?
+          ORDER BY GameState
+          LIMIT ?)
+    """, (last_state, chunk)).fetchone()
+    return row[0]
+
+
+def moves_chunk_end(conn: sqlite3.Connection, last_from: int, last_to: int,
+                    chunk: int) -> Optional[Tuple[int, int]]:
+    """ Return the last source (FromState, ToState) of the chunk after the given one, None at the end """
+    rows = conn.execute("""
+    SELECT FromState, ToState
+    FROM source.Moves
+    WHERE (FromState, ToState) > (?, ?)
+    ORDER BY FromState, ToState
+    LIMIT ?
+    """, (last_from, last_to, chunk)).fetchall()
+    return rows[-1] if rows else None
+
+
+def copy_states(conn: sqlite3.Connection, schema: str, chunk: int) -> None:
+    """ Copy GameTree in GameState order, one transaction per chunk, recording the last state copied """
+    expanded = source_expanded(conn)
+    last_state, copied = conn.execute("SELECT LastState, States FROM Migration").fetchone()
+    last_state = last_state if last_state is not None else -1
+    start_keys = {}
+    start_time = time.time()
+
+    while True:
+        end_state = chunk_end(conn, last_state, chunk)
+        if end_state is None:
+            break
+
+        if schema == 'full':
+            cursor = conn.execute(f"""
+            INSERT INTO GameTree ({SOURCE_COLUMNS}, Expanded)
+            SELECT {SOURCE_COLUMNS}, {expanded}
+            FROM source.GameTree
+            WHERE GameState > ? AND GameState <= ?
+            """, (last_state, end_state))
+            count = cursor.rowcount
+        else:
+            rows = conn.execute(f"""
+            SELECT {SOURCE_COLUMNS}, {expanded}
+            FROM source.GameTree
+            WHERE GameState > ? AND GameState <= ?
+            """, (last_state, end_state)).fetchall()
+            states = []
+            state_keys = []
+            for (start_state, state_id, board, score, active_spaces, tot_line_len, line_len_val,
+                 game_over, depth, state_expanded) in rows:
+                cells = board_cells(board)
+                state_key = signed_key(cells_hash(cells))
+                start_key = start_keys.get(start_state)
+                if start_key is None:
+                    start_key = start_state_key(conn, start_state)
+                    start_keys[start_state] = start_key
+                states.append((start_key, state_key, pack_cells(cells), score, active_spaces, tot_line_len,
+                               line_len_val, int(game_over), depth, state_expanded))
+                state_keys.append((state_id, start_key, state_key))
+            conn.executemany("INSERT OR IGNORE INTO GameTree VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", states)
+            conn.executemany("INSERT OR REPLACE INTO keys.StateKeys VALUES (?, ?, ?)", state_keys)
+            count = len(rows)
+
+        copied += count
+        last_state = end_state
+        conn.execute("UPDATE Migration SET LastState = ?, States = ?", (last_state, copied))
+        conn.commit()
+        print(f"States: {copied} to GameState {last_state} "
+              f"({copied / max(time.time() - start_time, 1e-9):.0f} per second this run)")
+
+    conn.execute("UPDATE Migration SET Phase = 'moves', LastState = NULL, LastTo = NULL")
+    conn.commit()
+
+
+def start_state_key(conn: sqlite3.Connection, start_state: int) -> int:
+    """ Return the board key of a start state, read from the source """
+    row = conn.execute("SELECT Board FROM source.GameTree WHERE GameState = ?", (start_state,)).fetchone()
+    if row is None:
+        raise ValueError(f"Start state {start_state} is missing from the source")
+    return signed_key(cells_hash(board_cells(row[0])))
+
+
+def copy_moves(conn: sqlite3.Connection, schema: str, chunk: int) -> None:
+    """ Copy Moves in primary key order, one transaction per chunk, recording the last move copied """
+    last_from, last_to, copied = conn.execute("SELECT LastState, LastTo, Moves FROM Migration").fetchone()
+    last_from = last_from if last_from is not None else -1
+    last_to = last_to if last_to is not None else -1
+    start_time = time.time()
+
+    while True:
+        end = moves_chunk_end(conn, last_from, last_to, chunk)
+        if end is None:
+            break
+
+        params = (last_from, last_to, end[0], end[1])
+        if schema == 'full':
+            cursor = conn.execute("""
+            INSERT INTO Moves
+            SELECT * FROM source.Moves
+            WHERE (FromState, ToState) > (?, ?) AND (FromState, ToState) <= (?, ?)
+            """, params)
+        else:
+            # Rows only clash if two boards share a key, which verification reports
+            cursor = conn.execute(f"""
+            INSERT OR IGNORE INTO Moves
+            SELECT from_key.StartKey, from_key.StateKey, to_key.StateKey,
+                   MoveFromRow * {ROW_LEN} + MoveFromCol, MoveToRow * {ROW_LEN} + MoveToCol
+            FROM source.Moves
+            JOIN keys.StateKeys AS from_key ON from_key.GameState = FromState
+            JOIN keys.StateKeys AS to_key ON to_key.GameState = ToState
+            WHERE (FromState, ToState) > (?, ?) AND (FromState, ToState) <= (?, ?)
+            """, params)
+
+        copied += cursor.rowcount
+        last_from, last_to = end
+        conn.execute("UPDATE Migration SET LastState = ?, LastTo = ?, Moves = ?", (last_from, last_to, copied))
+        conn.commit()
+        print(f"Moves: {copied} to FromState {last_from} "
+              f"({copied / max(time.time() - start_time, 1e-9):.0f} per second this run)")
+
+    conn.execute("UPDATE Migration SET Phase = 'indexes', LastState = NULL, LastTo = NULL")
+    conn.commit()
+
+
+def create_indexes(conn: sqlite3.Connection, schema: str) -> None:
+    """ Build the target schema's indexes once the tables are filled """
+    _, indexes = split_schema(SCHEMAS[schema])
+    for statement in indexes:
+        start_time = time.time()
+        statement = statement.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1)
+        statement = statement.replace('CREATE UNIQUE INDEX ', 'CREATE UNIQUE INDEX IF NOT EXISTS ', 1)
+        conn.execute(statement)
+        conn.commit()
+        print(f"{statement.split('(', 1)[0]} in {time.time() - start_time:.2f} seconds")
+    conn.execute("UPDATE Migration SET Phase = 'verify'")
+    conn.commit()
+
+
+def verify_migration(conn: sqlite3.Connection, schema: str, chunk: int) -> bool:
+    """
+    Check every source state and move is in the target, chunk by chunk
+
+    Compact boards are unpacked and compared with the source text, which
+    also catches two boards sharing a key. Returns True if all match.
+    """
+    expanded = source_expanded(conn)
+    errors = 0
+    checked = 0
+    last_state = -1
+    start_time = time.time()
+    while True:
+        end_state = chunk_end(conn, last_state, chunk)
+        if end_state is None:
+            break
+        if schema == 'full':
+            errors += conn.execute(f"""
+            SELECT COUNT(*) FROM (
+                SELECT {SOURCE_COLUMNS}, {expanded} FROM source.GameTree
+                WHERE GameState > ? AND GameState <= ?
+                EXCEPT
+                SELECT {SOURCE_COLUMNS}, Expanded FROM main.GameTree
+                WHERE GameState > ? AND GameState <= ?)
+            """, (last_state, end_state, last_state, end_state)).fetchone()[0]
+        else:
+            rows = conn.execute(f"""
+            SELECT source.GameTree.Board, source.GameTree.Score, source.GameTree.DepthLvl,
+                   source.GameTree.GameOver, {expanded}, target.Board, target.Score,
+                   target.DepthLvl, target.GameOver, target.Expanded
+            FROM source.GameTree
+            LEFT JOIN keys.StateKeys AS state_key USING (GameState)
+            LEFT JOIN main.GameTree AS target
+            ON target.StartKey = state_key.StartKey AND target.StateKey = state_key.StateKey
+            WHERE GameState > ? AND GameState <= ?
+            """, (last_state, end_state)).fetchall()
+            for (board, score, depth, game_over, state_expanded,
+                 packed, target_score, target_depth, target_game_over, target_expanded) in rows:
+                if (packed is None or unpack_cells(packed) != board_cells(board)
+                        or (score, depth, int(game_over), state_expanded)
+                        != (target_score, target_depth, target_game_over, target_expanded)):
+                    errors += 1
+        checked += conn.execute("SELECT COUNT(*) FROM source.GameTree WHERE GameState > ? AND GameState <= ?",
+                                (last_state, end_state)).fetchone()[0]
+        last_state = end_state
+        print(f"Verified states: {checked} Errors: {errors}")
+
+    # Every source move must have its target row
+    if schema == 'full':
+        missing_moves = conn.execute("""
+        SELECT COUNT(*) FROM source.Moves
+        WHERE NOT EXISTS (SELECT 1 FROM main.Moves
+                          WHERE main.Moves.FromState = source.Moves.FromState
+                          AND main.Moves.ToState = source.Moves.ToState)
+        """).fetchone()[0]
+    else:
+        missing_moves = conn.execute("""
+        SELECT COUNT(*) FROM source.Moves
+        LEFT JOIN keys.StateKeys AS from_key ON from_key.GameState = FromState
+        LEFT JOIN keys.StateKeys AS to_key ON to_key.GameState = ToState
+        WHERE NOT EXISTS (SELECT 1 FROM main.Moves
+                          WHERE StartKey = from_key.StartKey
+                          AND FromKey = from_key.StateKey
+                          AND ToKey = to_key.StateKey)
+        """).fetchone()[0]
+    errors += missing_moves
+
+    source_states, source_moves = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM source.GameTree), (SELECT COUNT(*) FROM source.Moves)").fetchone()
+    target_states, target_moves = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM main.GameTree), (SELECT COUNT(*) FROM main.Moves)").fetchone()
+    print(f"Source: {source_states} states {source_moves} moves, "
+          f"target: {target_states} states {target_moves} moves")
+    print(f"Missing moves: {missing_moves} Errors: {errors} "
+          f"Verified in {time.time() - start_time:.2f} seconds")
+    return errors == 0
+
+
+def migrate(source_path: str, target_path: str, schema: str, chunk: int = DEFAULT_CHUNK,
+            verify: bool = True) -> bool:
+    """
+    Migrate a database to a schema, carrying on from where an earlier run stopped
+
+    Each chunk is copied and its progress recorded in one transaction, so
+    the migration can be stopped at any point and run again. The source is
+    only read. Returns True once the target is complete and verified.
+    """
+    conn = open_migration(source_path, target_path, schema)
+    try:
+        phase = conn.execute("SELECT Phase FROM Migration").fetchone()[0]
+        print(f"Migrating {source_path} to the {schema} schema in {target_path}, phase {phase}")
+        if phase == 'states':
+            copy_states(conn, schema, chunk)
+            phase = 'moves'
+        if phase == 'moves':
+            copy_moves(conn, schema, chunk)
+            phase = 'indexes'
+        if phase == 'indexes':
+            create_indexes(conn, schema)
+            phase = 'verify'
+        if phase == 'verify':
+            if verify and not verify_migration(conn, schema, chunk):
+                print("Verification failed, the target is left in the verify phase")
+                return False
+            conn.execute("UPDATE Migration SET Phase = 'done'")
+            conn.commit()
+            phase = 'done'
+        print("Migration done")
+    finally:
+        conn.close()
+
+    # The key map is only needed while copying and verifying
+    if phase == 'done' and schema == 'compact' and os.path.exists(keys_path(target_path)):
+        os.remove(keys_path(target_path))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a GameTree database into a new schema, resumably.")
+    parser.add_argument('source', help="database in the db/schema.sql layout, only read")
+    parser.add_argument('target', help="database to create, or to carry on migrating into")
+    parser.add_argument('--schema', choices=sorted(SCHEMAS), default='compact',
+                        help="compact (db/schema_compact.sql) or full (db/schema.sql, to re-index)")
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK,
+                        help=f"rows per transaction (default {DEFAULT_CHUNK})")
+    parser.add_argument('--no-verify', action='store_true', help="skip the verification pass")
+    args = parser.parse_args()
+
+    if os.path.abspath(args.source) == os.path.abspath(args.target):
+        print("Source and target must be different files")
+        return
+    try:
+        migrate(os.path.expanduser(args.source), os.path.expanduser(args.target), args.schema,
+                args.chunk, not args.no_verify)
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Error migrating database: {e}")
+
+
+if __name__ == "__main__":
+    main()
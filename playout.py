@@ -0,0 +1,220 @@
+# SpacesAces - Monte-Carlo playouts scoring a state by random or greedy games
+# Copyright (C) 2024 John Barron <jbarronuk@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import random
+import time
+from typing import NamedTuple, Optional
+
+from gamestate import GameState, EMPTY, NUM_ROWS, ROW_LEN, CELL_COL, CELL_ROW, NEXT_CARD
+
+# Playouts stop after this many moves, as moves can go round in circles
+MAX_PLAYOUT_MOVES = 200
+
+# A state has at most 16 moves, four aces for each of four first column spaces
+MAX_STATE_MOVES = 16
+
+ACES = bytes(range(0, 52, 13))
+
+
+class PlayoutStats(NamedTuple):
+    """ Final scores of a set of playouts from one state """
+    playouts: int
+    mean: float
+    stdev: float
+    best: int
+    wins: int
+
+
+def sequence_runs(cells) -> bytearray:
+    """
+    Return each row's count of in-sequence cells, counting the ace in the first column
+
+    Cards in a run never move again, so runs only grow as a game is played
+    and a row's score is its run less the ace.
+    """
+    runs = bytearray(NUM_ROWS)
+    for row in range(NUM_ROWS):
+        row_start = row * ROW_LEN
+        ace = cells[row_start]
+        if ace != EMPTY:
+            run = 1
+            while run < 13 and cells[row_start + run] == ace + run:
+                run += 1
+            runs[row] = run
+    return runs
+
+
+def playout_stats(game: GameState, count: int = 1000, greedy: bool = True,
+                  max_moves: int = MAX_PLAYOUT_MOVES, rng: Optional[random.Random] = None) -> PlayoutStats:
+    """
+    Play count games to the end from a state and return their score statistics.
+
+    Random playouts pick any legal move. Greedy ones pick a move that grows
+    a row's run or puts an ace in the first column if there is one, then a
+    move leaving a space that has a move of its own, then any move.
+    Each game is played on the state's own cells and positions and then
+    undone move by move, with the moves, spaces and undo history in buffers
+    set up once, so no objects are made per move beyond the random draw.
+    The state is left as it was. Pass rng for repeatable results.
+    """
+    rand = (rng or random).random
+    cells = game.cells
+    pos = game.pos
+    spaces = bytearray(game.space_cells)
+    base_runs = bytes(sequence_runs(cells))
+    runs = bytearray(base_runs)
+    moves = bytearray(2 * MAX_STATE_MOVES)
+    scoring = bytearray(2 * MAX_STATE_MOVES)
+    live = bytearray(2 * MAX_STATE_MOVES)
+    history = bytearray(2 * max_moves)
+
+    total = 0
+    total_sq = 0
+    best = 0
+    wins = 0
+    for _ in range(count):
+        steps = 0
+        while steps < max_moves:
+            # List the (space_index, source_cell) moves, and the greedy choices apart
+            num_moves = 0
+            num_scoring = 0
+            num_live = 0
+            for space_index in range(4):
+                target = spaces[space_index]
+                col = CELL_COL[target]
+                if col:
+                    card = NEXT_CARD[cells[target - 1]]
+                    if card == EMPTY:
+                        continue
+                    moves[num_moves] = space_index
+                    moves[num_moves + 1] = pos[card]
+                    num_moves += 2
+                    if greedy and col == runs[CELL_ROW[target]]:
+                        scoring[num_scoring] = space_index
+                        scoring[num_scoring + 1] = pos[card]
+                        num_scoring += 2
+                    elif greedy and NEXT_CARD[cells[pos[card] - 1]] != EMPTY:
+                        live[num_live] = space_index
+                        live[num_live + 1] = pos[card]
+                        num_live += 2
+                else:
+                    for ace in ACES:
+                        source = pos[ace]
+                        if CELL_COL[source]:
+                            moves[num_moves] = space_index
+                            moves[num_moves + 1] = source
+                            num_moves += 2
+                            if greedy:
+                                scoring[num_scoring] = space_index
+                                scoring[num_scoring + 1] = source
+                                num_scoring += 2
+            if not num_moves:
+                break
+
+            if num_scoring:
+                pick = int(rand() * (num_scoring >> 1)) << 1
+                space_index = scoring[pick]
+                source = scoring[pick + 1]
+            elif num_live:
+                pick = int(rand() * (num_live >> 1)) << 1
+                space_index = live[pick]
+                source = live[pick + 1]
+            else:
+                pick = int(rand() * (num_moves >> 1)) << 1
+                space_index = moves[pick]
+                source = moves[pick + 1]
+
+            # Make the move, noting the target for the undo
+            target = spaces[space_index]
+            card = cells[source]
+            cells[target] = card
+            cells[source] = EMPTY
+            pos[card] = target
+            spaces[space_index] = source
+            history[2 * steps] = space_index
+            history[2 * steps + 1] = target
+            steps += 1
+
+            row = CELL_ROW[target]
+            run = runs[row]
+            if CELL_COL[target] == run:
+                row_start = target - run
+                ace = cells[row_start]
+                run += 1
+                while run < 13 and cells[row_start + run] == ace + run:
+                    run += 1
+                runs[row] = run
+
+        score = 0
+        for run in runs:
+            if run:
+                score += run - 1
+        total += score
+        total_sq += score * score
+        if score > best:
+            best = score
+        if score == 48:
+            wins += 1
+
+        # Unmake the moves, last first
+        while steps:
+            steps -= 1
+            space_index = history[2 * steps]
+            target = history[2 * steps + 1]
+            source = spaces[space_index]
+            card = cells[target]
+            cells[source] = card
+            cells[target] = EMPTY
+            pos[card] = source
+            spaces[space_index] = target
+        runs[:] = base_runs
+
+    if not count:
+        return PlayoutStats(0, 0.0, 0.0, 0, 0)
+    mean = total / count
+    return PlayoutStats(count, mean, math.sqrt(max(total_sq / count - mean * mean, 0.0)), best, wins)
+
+
+def playout_value(game: GameState, count: int, rng: Optional[random.Random] = None) -> float:
+    """ Return the mean score of count greedy playouts, a ranking key in place of LineLenVal """
+    return playout_stats(game, count, True, MAX_PLAYOUT_MOVES, rng).mean
+
+
+def main():
+    user_input = input("Enter deal number or filename: ").strip()
+    if user_input.isdigit():
+        game = GameState.from_deal(int(user_input))
+    elif user_input:
+        game = GameState.load_game(user_input)
+    else:
+        return
+
+    user_input = input("Set number of playouts (Enter=10000): ").strip()
+    count = int(user_input) if user_input else 10000
+    greedy = input("Greedy playouts Y or N?: ").strip().lower() != 'n'
+
+    print(game.save_game())
+    start_time = time.time()
+    stats = playout_stats(game, count, greedy)
+    elapsed_time = time.time() - start_time
+    print(f"Playouts: {stats.playouts} Mean score: {stats.mean:.2f} Std dev: {stats.stdev:.2f} "
+          f"Best: {stats.best} Wins: {stats.wins}")
+    print(f"Time: {elapsed_time:.2f} seconds, {stats.playouts / max(elapsed_time, 1e-9):.0f} playouts per second")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# SpacesAces - Sharded analysis with start states split across database files
+# Copyright (C) 2024 John Barron <jbarronuk@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+from gamestate import GameState
+from analyze import insert_game_state, fraction_search, best_first_search
+from statestore import SQLiteStateStore, add_expanded_column, FLUSH_STATES, FLUSH_MS
+
+# Shard k numbers its states from (k + 1) * SHARD_ID_SPAN, so GameState IDs
+# stay unique across shards and apart from an unsharded database, shards
+# merge without renumbering and the shard holding any state follows from its ID.
+SHARD_ID_SPAN = 1 << 40
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db', 'schema.sql')
+
+
+def clear_screen():
+    os.system('cls' if os.name == 'nt' else 'clear')
+
+
+def shard_path(db_path: str, shard: int) -> str:
+    """ Return the database file for a shard, e.g. GameTree_shard03.db """
+    base, ext = os.path.splitext(db_path)
+    return f"{base}_shard{shard:02d}{ext}"
+
+
+def shard_of_state(state_id: int) -> int:
+    """ Return the shard holding a GameState or StartState ID, -1 if unsharded """
+    return state_id // SHARD_ID_SPAN - 1
+
+
+def shard_offset(shard: int) -> int:
+    """ Return the first GameState ID of a shard's range, less one """
+    return (shard + 1) * SHARD_ID_SPAN
+
+
+def resolve_db_path(db_path: str, state_id: int, use_shards: bool) -> str:
+    """ Return the database file to read a state from, its shard file when sharded """
+    if use_shards and shard_of_state(state_id) >= 0:
+        return shard_path(db_path, shard_of_state(state_id))
+    return db_path
+
+
+def create_database(path: str) -> sqlite3.Connection:
+    """ Open a database file, creating the GameTree schema if it is new """
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'GameTree'")
+    if cursor.fetchone() is None:
+        with open(SCHEMA_PATH, 'r') as f:
+            conn.executescript(f.read())
+    return conn
+
+
+def next_start_id(conn: sqlite3.Connection, shard: int) -> int:
+    """ Return the next free GameState ID in a shard's range """
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(GameState) FROM GameTree")
+    max_id = cursor.fetchone()[0] or 0
+    next_id = max(max_id, shard_offset(shard)) + 1
+    if shard_of_state(next_id) != shard:
+        raise ValueError(f"Shard {shard} has used its whole ID range")
+    return next_id
+
+
+def split_database(db_path: str, num_shards: int) -> None:
+    """
+    Copy the start states of a database into num_shards shard files
+
+    StartState modulo num_shards picks the shard, and IDs are moved into
+    the shard's range. The source database is left unchanged.
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(GameState) FROM GameTree")
+    max_id = cursor.fetchone()[0] or 0
+    conn.close()
+    if max_id >= SHARD_ID_SPAN:
+        print("Database IDs are already in shard ranges, cannot split")
+        return
+
+    for shard in range(num_shards):
+        start_time = time.time()
+        offset = shard_offset(shard)
+        shard_conn = create_database(shard_path(db_path, shard))
+        try:
+            shard_conn.execute("ATTACH DATABASE ? AS source", (db_path,))
+            cursor = shard_conn.cursor()
+            cursor.execute("BEGIN TRANSACTION")
+            cursor.execute("""
+                INSERT OR IGNORE INTO GameTree
+                SELECT StartState + ?, GameState + ?, Board, Score, ActiveSpaces,
+                       TotLineLen, LineLenVal, GameOver, DepthLvl,
+                       GameState IN (SELECT FromState FROM source.Moves)
+                FROM source.GameTree
+                WHERE StartState % ? = ?
+            """, (offset, offset, num_shards, shard))
+            copied_states = cursor.rowcount
+            cursor.execute("""
+                INSERT OR IGNORE INTO Moves
+                SELECT StartState + ?, FromState + ?, ToState + ?,
+                       MoveFromRow, MoveFromCol, MoveToRow, MoveToCol
+                FROM source.Moves
+                WHERE StartState % ? = ?
+            """, (offset, offset, offset, num_shards, shard))
+            copied_moves = cursor.rowcount
+            shard_conn.commit()
+            shard_conn.execute("DETACH DATABASE source")
+            print(f"Shard {shard}: {copied_states} states, {copied_moves} moves "
+                  f"in {time.time() - start_time:.2f} seconds")
+        except sqlite3.Error as e:
+            shard_conn.rollback()
+            print(f"Error splitting shard {shard}: {e}")
+        finally:
+            shard_conn.close()
+
+
+def add_deals(db_path: str, num_shards: int, first_deal: int, count: int) -> None:
+    """ Add numbered deals as start states, deal number modulo num_shards picks the shard """
+    for shard in range(num_shards):
+        deals = [deal_number for deal_number in range(first_deal, first_deal + count)
+                 if deal_number % num_shards == shard]
+        if not deals:
+            continue
+        conn = create_database(shard_path(db_path, shard))
+        try:
+            for deal_number in deals:
+                insert_game_state(conn, GameState.from_deal(deal_number), next_start_id(conn, shard))
+                conn.commit()
+        finally:
+            conn.close()
+
+
+def run_shard(db_path: str, shard: int, search_mode: str, search_fraction: float,
+              num_iter: int, max_states: int, canonical: bool,
+              flush_states: int = FLUSH_STATES, flush_ms: float = FLUSH_MS) -> None:
+    """ Search every start state in one shard, logging to the shard's .log file """
+    path = shard_path(db_path, shard)
+    with open(os.path.splitext(path)[0] + '.log', 'a') as log_file:
+        sys.stdout = log_file
+        try:
+            store = SQLiteStateStore(path)
+        except sqlite3.Error as e:
+            print(f"Error connecting to database: {e}")
+            return
+        store.buffer_writes(flush_states, flush_ms)
+        try:
+            if search_mode == 'b':
+                best_first_search(store, 0, max_states, canonical)
+            else:
+                fraction_search(store, 0, search_fraction, num_iter, canonical)
+        finally:
+            store.close()
+            sys.stdout.flush()
+
+
+def run_workers(db_path: str, num_shards: int, search_mode: str, search_fraction: float,
+                num_iter: int, max_states: int, canonical: bool,
+                flush_states: int = FLUSH_STATES, flush_ms: float = FLUSH_MS) -> None:
+    """ Run one worker process per existing shard file and wait for them all """
+    start_time = time.time()
+    workers = []
+    for shard in range(num_shards):
+        if not os.path.exists(shard_path(db_path, shard)):
+            continue
+        worker = multiprocessing.Process(target=run_shard,
+                                         args=(db_path, shard, search_mode, search_fraction,
+                                               num_iter, max_states, canonical, flush_states, flush_ms))
+        worker.start()
+        workers.append((shard, worker))
+    print(f"Started {len(workers)} workers")
+
+    for shard, worker in workers:
+        worker.join()
+        print(f"Shard {shard} finished with exit code {worker.exitcode}")
+    print(f"All shards finished in {time.time() - start_time:.2f} seconds")
+
+
+def merge_shards(db_path: str, num_shards: int, merged_path: str) -> None:
+    """
+    Copy every shard file into one database, for tracing and cleaning in one place
+
+    Merge into a new file rather than the database that was split, which
+    still holds the split start states under their original IDs.
+    """
+    conn = create_database(merged_path)
+    try:
+        for shard in range(num_shards):
+            path = shard_path(db_path, shard)
+            if not os.path.exists(path):
+                continue
+            start_time = time.time()
+            # SELECT * needs the shard's columns to match
+            shard_conn = sqlite3.connect(path)
+            add_expanded_column(shard_conn)
+            shard_conn.close()
+            conn.execute("ATTACH DATABASE ? AS shard", (path,))
+            cursor = conn.cursor()
+            cursor.execute("BEGIN TRANSACTION")
+            cursor.execute("INSERT OR IGNORE INTO GameTree SELECT * FROM shard.GameTree")
+            merged_states = cursor.rowcount
+            cursor.execute("INSERT OR IGNORE INTO Moves SELECT * FROM shard.Moves")
+            merged_moves = cursor.rowcount
+            conn.commit()
+            conn.execute("DETACH DATABASE shard")
+            print(f"Shard {shard}: {merged_states} states, {merged_moves} moves "
+                  f"in {time.time() - start_time:.2f} seconds")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error merging shards: {e}")
+    finally:
+        conn.close()
+
+
+def main():
+    db_path = os.path.expanduser('~/Database/GameTree.db')  # Replace with your actual database path
+
+    clear_screen()
+    print(f"Database path: {db_path}")
+
+    user_input = input("Set number of shards: ").strip()
+    num_shards = int(user_input)
+
+    while True:
+        action = input("\n(S)plit database, add (D)eals, (R)un workers, (M)erge shards or (Q)uit: ").strip().lower()
+        if action == 'q':
+            break
+
+        if action == 's':
+            split_database(db_path, num_shards)
+
+        elif action == 'd':
+            first_deal = int(input("Enter first deal number: ").strip())
+            count = int(input("Enter number of deals: ").strip())
+            add_deals(db_path, num_shards, first_deal, count)
+
+        elif action == 'r':
+            search_mode = input("Search mode (F)raction or (B)est-first: ").strip().lower()
+            search_fraction = 0.75
+            num_iter = 0
+            max_states = 0
+            if search_mode == 'b':
+                max_states = int(input("Set states to expand per shard: ").strip())
+            else:
+                user_input = input("Set search breadth fraction: ").strip()
+                if user_input:
+                    search_fraction = float(user_input)
+                num_iter = int(input("Set iterations to explore: ").strip())
+            canonical = input("Deduplicate row permutations Y or N?: ").strip().lower() == 'y'
+            user_input = input(f"Set states per commit (1=Every state, Enter={FLUSH_STATES}): ").strip().lower()
+            flush_states = int(user_input) if user_input else FLUSH_STATES
+            user_input = input(f"Set milliseconds per commit (0=None, Enter={FLUSH_MS}): ").strip().lower()
+            flush_ms = float(user_input) if user_input else FLUSH_MS
+            run_workers(db_path, num_shards, search_mode, search_fraction, num_iter, max_states, canonical,
+                        flush_states, flush_ms)
+
+        elif action == 'm':
+            default_path = os.path.splitext(db_path)[0] + '_merged.db'
+            merged_path = input(f"Enter database to merge into (Enter for {default_path}): ").strip()
+            merge_shards(db_path, num_shards, os.path.expanduser(merged_path) or default_path)
+
+
+if __name__ == "__main__":
+    main()
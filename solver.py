@@ -0,0 +1,302 @@
+# SpacesAces - In-memory solver searching a single deal without the database
+# Copyright (C) 2024 John Barron <jbarronuk@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import signal
+import struct
+import time
+from array import array
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from gamestate import GameState, CELL_COL, CELL_RC, NUM_CELLS, ROW_LEN
+
+RowCol = Tuple[int, int]
+# (from_cell, to_cell), which unlike (space_index, move_index) does not
+# depend on the order the moves of a state were listed in
+CellMove = Tuple[int, int]
+
+# Checkpoint files start with the magic and the root board, then this header
+CHECKPOINT_MAGIC = b'SACKPT1\n'
+CHECKPOINT_HEADER = struct.Struct('<QdBIII')
+
+
+class Checkpoint(NamedTuple):
+    """ Open search of a stopped solve, enough to carry on where it left off """
+    cells: bytes
+    nodes: int
+    seconds: float
+    best_score: int
+    best_moves: List[CellMove]
+    path: List[CellMove]
+    pending: List[List[CellMove]]
+    visited: array
+
+
+class SolveResult(NamedTuple):
+    """
+    Outcome of a search: moves are (from_rowcol, to_rowcol) pairs as stored in Moves
+
+    checkpoint is set when the search stopped early, None once it is finished.
+    """
+    solved: bool
+    score: int
+    moves: List[Tuple[RowCol, RowCol]]
+    nodes: int
+    seconds: float
+    checkpoint: Optional[Checkpoint] = None
+
+
+def ordered_moves(game: GameState) -> List[Tuple[int, int]]:
+    """
+    Return the (space_index, move_index) moves of a state, best last.
+
+    Children are ranked by score, each applied and undone in place, with
+    ace moves to the first column ahead of other moves on equal score.
+    Ranking on score alone searches several times more states per second
+    than ranking on line lengths, and finds better lines for the same budget.
+    """
+    ranked = []
+    for space_index, moves in enumerate(game.move_cells):
+        if moves:
+            ace_move = CELL_COL[game.space_cells[space_index]] == 0
+            for move_index in range(len(moves)):
+                undo = game.make_move(space_index, move_index)
+                score = game.calculate_score()
+                game.unmake_move(undo)
+                ranked.append((score, ace_move, space_index, move_index))
+    ranked.sort()
+    return [(space_index, move_index) for _, _, space_index, move_index in ranked]
+
+
+def find_move(game: GameState, move: CellMove) -> Tuple[int, int]:
+    """ Return the (space_index, move_index) of a (from_cell, to_cell) move of the state """
+    from_cell, to_cell = move
+    space_index = game.space_cells.index(to_cell)
+    return space_index, game.move_cells[space_index].index(from_cell)
+
+
+def rowcol_moves(moves: List[CellMove]) -> List[Tuple[RowCol, RowCol]]:
+    """ Convert (from_cell, to_cell) moves to (from_rowcol, to_rowcol) """
+    return [(CELL_RC[from_cell], CELL_RC[to_cell]) for from_cell, to_cell in moves]
+
+
+def solve(board, max_nodes: Optional[int] = None, max_seconds: Optional[float] = None,
+          resume: Optional[Checkpoint] = None,
+          on_best: Optional[Callable[[int, List[Tuple[RowCol, RowCol]]], None]] = None,
+          should_stop: Optional[Callable[[], bool]] = None) -> SolveResult:
+    """
+    Search a deal depth first for a 48 card solution.
+
+    board is save_game text or a GameState, which is searched in place and
+    left as it was. States are deduplicated through a transposition table
+    of Zobrist keys, and a state is not expanded when its score upper bound
+    cannot beat the best score found so far. Returns the solution, or the
+    best scoring line found when the tree is exhausted.
+
+    The search can stop at any time: after max_nodes states or max_seconds
+    in this run, or when should_stop returns True. The result then holds a
+    checkpoint that resume carries on from, and nodes and seconds count
+    the earlier runs too. on_best is called with each better line found.
+    """
+    game = board if isinstance(board, GameState) else GameState.from_board(board)
+    start_time = time.time()
+
+    if resume is None:
+        visited = {game.key()}
+        nodes = 1
+        seconds = 0.0
+        best_score = game.calculate_score()
+        best_moves = []
+        path = []
+        undo_stack = []
+        pending_stack = [ordered_moves(game)]
+    else:
+        if resume.cells != game.to_bytes():
+            raise ValueError("Checkpoint is for a different board")
+        visited = set(resume.visited)
+        nodes = resume.nodes
+        seconds = resume.seconds
+        best_score = resume.best_score
+        best_moves = rowcol_moves(resume.best_moves)
+        path = rowcol_moves(resume.path)
+        undo_stack = []
+        pending_stack = []
+        # Replay the open path, turning each level's moves back into indices
+        for level, pending in enumerate(resume.pending):
+            pending_stack.append([find_move(game, move) for move in pending])
+            if level < len(resume.path):
+                undo_stack.append(game.make_move(*find_move(game, resume.path[level])))
+    run_nodes = nodes - (resume.nodes if resume else 0)
+
+    stopped = False
+    while pending_stack and best_score < 48:
+        if ((max_nodes and run_nodes >= max_nodes) or
+                (max_seconds and time.time() - start_time >= max_seconds) or
+                (should_stop and should_stop())):
+            stopped = True
+            break
+
+        pending = pending_stack[-1]
+        if not pending:
+            # All children searched, back up a level
+            pending_stack.pop()
+            if undo_stack:
+                game.unmake_move(undo_stack.pop())
+                path.pop()
+            continue
+
+        space_index, move_index = pending.pop()
+        from_rowcol = CELL_RC[game.move_cells[space_index][move_index]]
+        to_rowcol = CELL_RC[game.space_cells[space_index]]
+        undo = game.make_move(space_index, move_index)
+
+        # Transposition, already searched through another move order
+        key = game.key()
+        if key in visited:
+            game.unmake_move(undo)
+            continue
+        visited.add(key)
+        nodes += 1
+        run_nodes += 1
+
+        path.append((from_rowcol, to_rowcol))
+        undo_stack.append(undo)
+        score = game.calculate_score()
+        if score > best_score:
+            best_score = score
+            best_moves = path.copy()
+            if on_best:
+                on_best(best_score, best_moves)
+
+        # Branch and bound, nothing below here can beat the best line
+        if game.score_upper_bound() <= best_score:
+            pending_stack.append([])
+            continue
+
+        pending_stack.append(ordered_moves(game))
+
+    # Leave the caller's state as it was, noting the open moves of each level on the way back
+    pending_cells = []
+    path_cells = []
+    for level in range(len(pending_stack) - 1, -1, -1):
+        pending_cells.append([(game.move_cells[space_index][move_index], game.space_cells[space_index])
+                              for space_index, move_index in pending_stack[level]])
+        if level:
+            undo = undo_stack.pop()
+            game.unmake_move(undo)
+            path_cells.append((undo[2], undo[1]))
+    seconds += time.time() - start_time
+
+    checkpoint = None
+    if stopped:
+        checkpoint = Checkpoint(game.to_bytes(), nodes, seconds, best_score,
+                                [(from_row * ROW_LEN + from_col, to_row * ROW_LEN + to_col)
+                                 for (from_row, from_col), (to_row, to_col) in best_moves],
+                                path_cells[::-1], pending_cells[::-1], array('Q', sorted(visited)))
+
+    return SolveResult(best_score == 48, best_score, best_moves, nodes, seconds, checkpoint)
+
+
+def save_checkpoint(checkpoint: Checkpoint, filename: str) -> None:
+    """ Write a checkpoint, moves as pairs of cell bytes and visited keys as 64-bit integers """
+    with open(filename, 'wb') as f:
+        f.write(CHECKPOINT_MAGIC)
+        f.write(checkpoint.cells)
+        f.write(CHECKPOINT_HEADER.pack(checkpoint.nodes, checkpoint.seconds, checkpoint.best_score,
+                                       len(checkpoint.best_moves), len(checkpoint.path),
+                                       len(checkpoint.pending)))
+        for moves in (checkpoint.best_moves, checkpoint.path):
+            f.write(bytes(cell for move in moves for cell in move))
+        for pending in checkpoint.pending:
+            f.write(bytes([len(pending)]) + bytes(cell for move in pending for cell in move))
+        f.write(struct.pack('<Q', len(checkpoint.visited)))
+        checkpoint.visited.tofile(f)
+
+
+def load_checkpoint(filename: str) -> Checkpoint:
+    """ Read a checkpoint written by save_checkpoint """
+    with open(filename, 'rb') as f:
+        if f.read(len(CHECKPOINT_MAGIC)) != CHECKPOINT_MAGIC:
+            raise ValueError(f"{filename} is not a solver checkpoint")
+        cells = f.read(NUM_CELLS)
+        nodes, seconds, best_score, num_best, num_path, num_levels = \
+            CHECKPOINT_HEADER.unpack(f.read(CHECKPOINT_HEADER.size))
+
+        def read_moves(count):
+            data = f.read(2 * count)
+            return [(data[i], data[i + 1]) for i in range(0, len(data), 2)]
+
+        best_moves = read_moves(num_best)
+        path = read_moves(num_path)
+        pending = [read_moves(f.read(1)[0]) for _ in range(num_levels)]
+        num_visited, = struct.unpack('<Q', f.read(8))
+        visited = array('Q')
+        visited.fromfile(f, num_visited)
+    return Checkpoint(cells, nodes, seconds, best_score, best_moves, path, pending, visited)
+
+
+def main():
+    game = None
+    resume = None
+    user_input = input("Enter deal number, filename or checkpoint to solve: ").strip()
+    if user_input.isdigit():
+        game = GameState.from_deal(int(user_input))
+        checkpoint_file = f"{user_input}.ckpt"
+    elif user_input.endswith('.ckpt'):
+        resume = load_checkpoint(user_input)
+        game = GameState(resume.cells)
+        checkpoint_file = user_input
+    elif user_input:
+        game = GameState.load_game(user_input)
+        checkpoint_file = user_input.rsplit('.', 1)[0] + '.ckpt'
+    else:
+        return
+
+    user_input = input("Set node limit (or press Enter for none): ").strip()
+    max_nodes = int(user_input) if user_input else None
+    user_input = input("Set time limit in seconds (or press Enter for none): ").strip()
+    max_seconds = float(user_input) if user_input else None
+
+    print(game.save_game())
+    if resume:
+        print(f"Resuming at best score {resume.best_score} after {resume.nodes} nodes")
+    print("Press Ctrl-C to stop and save a checkpoint")
+
+    # Ctrl-C stops the search between states, so it can be checkpointed
+    stop_requested = []
+    previous_handler = signal.signal(signal.SIGINT, lambda signum, frame: stop_requested.append(signum))
+    try:
+        result = solve(game, max_nodes, max_seconds, resume,
+                       on_best=lambda score, moves: print(f"Best score {score} at move {len(moves)}"),
+                       should_stop=lambda: bool(stop_requested))
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+
+    if result.solved:
+        print(f"\nSolution found! Perfect score of 48 achieved.")
+    else:
+        print(f"\nBest score: {result.score}")
+    print(f"Moves: {len(result.moves)} Nodes: {result.nodes} Time: {result.seconds:.2f} seconds")
+    for from_rowcol, to_rowcol in result.moves:
+        print(f"Move from: {from_rowcol[0]}, {from_rowcol[1]} to: {to_rowcol[0]}, {to_rowcol[1]}")
+
+    if result.checkpoint:
+        user_input = input(f"Enter checkpoint file to save (or press Enter for {checkpoint_file}): ").strip()
+        save_checkpoint(result.checkpoint, user_input or checkpoint_file)
+        print(f"Checkpoint saved with {len(result.checkpoint.visited)} visited states")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1203 @@
+# SpacesAces - State stores holding a search tree in SQLite, in memory or in a memory-mapped log
+# Copyright (C) 2024 John Barron <jbarronuk@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import abc
+import mmap
+import os
+import sqlite3
+import struct
+import time
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from gamestate import CARD_ID, CELL_RC, ROW_LEN, cells_hash, cells_to_text, pack_cells, unpack_cells, signed_key
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db', 'schema.sql')
+COMPACT_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db', 'schema_compact.sql')
+# Boards whose GameState ID a SQLite store keeps in memory before starting over,
+# about 110 bytes each
+STATE_ID_CACHE_SIZE = 1 << 18
+# Default commit interval of buffered writes, in expanded states and milliseconds
+FLUSH_STATES = 1000
+FLUSH_MS = 2000
+HASH_MASK = (1 << 64) - 1
+# Answers to the state store prompt of the tools
+STORE_KINDS = {'s': 'sqlite', 'c': 'compact', 'l': 'log'}
+
+
+class StoredState(NamedTuple):
+    """
+    A state as held by a store, the same fields as a GameTree row with the board as cells
+
+    key and cells can be None in a frontier read without its boards.
+    """
+    state_id: int
+    start_state: int
+    key: Optional[int]
+    cells: Optional[bytes]
+    score: int
+    active_spaces: int
+    tot_line_len: int
+    line_len_val: float
+    game_over: int
+    depth: int
+    expanded: bool
+
+
+class StateStore(abc.ABC):
+    """
+    Storage for a search tree: states, the moves between them and the unexpanded frontier
+
+    A state is identified within its start state by the Zobrist key of its
+    board, the cells settling the rare case of two boards sharing a key.
+    IDs are positive and a start state's StartState is its own ID. Writes
+    are only durable once commit returns. Searches call commit_writes
+    after each expanded state, which commits every time until
+    buffer_writes sets an interval.
+    """
+    flush_states = 0
+    flush_ms = 0
+    uncommitted_states = 0
+    last_commit = 0.0
+
+    @abc.abstractmethod
+    def put_state(self, start_state: int, key: int, cells, score: int, active_spaces: int,
+                  tot_line_len: int, line_len_val: float, game_over: int, depth: int) -> Tuple[int, bool]:
+        """
+        Store a state unless already stored, returns (state ID, newly stored)
+
+        start_state 0 stores a start state.
+        """
+
+    @abc.abstractmethod
+    def get_id(self, start_state: int, key: int, cells) -> Optional[int]:
+        """ Return the ID of a stored state, None if it is not stored """
+
+    @abc.abstractmethod
+    def get_state(self, state_id: int) -> Optional[StoredState]:
+        """ Return a stored state, None if there is no state with the ID """
+
+    @abc.abstractmethod
+    def add_edge(self, start_state: int, from_id: int, to_id: int, from_cell: int, to_cell: int) -> None:
+        """ Store the move from one state to another, cells as row * 14 + col """
+
+    @abc.abstractmethod
+    def mark_expanded(self, state_id: int) -> None:
+        """ Note that all the moves of a state are stored """
+
+    @abc.abstractmethod
+    def frontier(self, start_state: int = 0, with_cells: bool = True) -> List[StoredState]:
+        """
+        Return the unexpanded states still in play, of one start state or of all with 0
+
+        The list is taken when called, so states can be stored while going
+        through it and only show up in the next frontier. Without
+        with_cells the boards are not read.
+        """
+
+    @abc.abstractmethod
+    def moves_into(self, state_id: int) -> List[Tuple[int, int, int]]:
+        """ Return the stored moves into a state as (from ID, from cell, to cell) """
+
+    @abc.abstractmethod
+    def start_states(self) -> List[int]:
+        """ Return the IDs of the start states """
+
+    @abc.abstractmethod
+    def best_state(self, start_state: int) -> Optional[StoredState]:
+        """ Return the state of a start state with the highest Score, then the lowest depth """
+
+    @abc.abstractmethod
+    def clean(self, start_state: int, keep: Set[int]) -> Tuple[int, int]:
+        """
+        Drop the moves and the states of a start state other than those in keep
+
+        The kept states go back in the frontier. Returns (states dropped,
+        moves dropped).
+        """
+
+    def buffer_writes(self, flush_states: int = FLUSH_STATES, flush_ms: float = FLUSH_MS) -> None:
+        """ Commit every flush_states expanded states or flush_ms milliseconds, 0 for no limit """
+        self.flush_states = flush_states
+        self.flush_ms = flush_ms
+        self.last_commit = time.time()
+
+    def commit_writes(self, states: int = 1, force: bool = False) -> None:
+        """
+        Commit after expanding states
+
+        Once buffer_writes has set an interval this only commits when it is
+        reached, or with force set. Searches force a commit when they find
+        a solution and when they finish.
+        """
+        self.uncommitted_states += states
+        if (self.flush_states or self.flush_ms) and not (
+                force
+                or (self.flush_states and self.uncommitted_states >= self.flush_states)
+                or (self.flush_ms and (time.time() - self.last_commit) * 1000 >= self.flush_ms)):
+            return
+        self.commit()
+        self.uncommitted_states = 0
+        self.last_commit = time.time()
+
+    def commit(self) -> None:
+        """ Make everything stored so far durable """
+
+    def rollback(self) -> None:
+        """ Drop what was stored since the last commit, where the store can """
+
+    def vacuum(self) -> None:
+        """ Give the space freed by clean back to the file system, where the store can """
+
+    def close(self) -> None:
+        """ Commit and release the store """
+        self.commit()
+
+
+class StateCacheConnection(sqlite3.Connection):
+    """
+    Connection remembering the GameState ID of each (StartState, Board) it stores
+
+    SQLiteStateStore finds a state seen before here instead of in the
+    unique board index. state_ids is keyed on StartState and the board's
+    64-bit Zobrist key in one int, and holds the GameState ID with a 32-bit
+    checksum of the board cells, which must match for a hit. A rollback
+    may undo stored states, so it empties the cache.
+
+    After buffer_writes, new GameTree and Moves rows are held in memory,
+    with GameState IDs handed out here, and written with executemany by
+    flush. commit_writes commits them every flush_states expanded states
+    or flush_ms milliseconds instead of after each state. A state missing
+    from the cache is taken as new without reading the table, and flush
+    finds any that were stored already. It maps their IDs to the stored
+    ones in remapped, for the rows written from then on.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.state_ids = {}
+        self.flush_states = 0
+        self.flush_ms = 0
+        self.buffering = False
+        self.next_state_id = None
+        self.min_state_id = 1
+        # Buffered GameTree rows, with consecutive IDs, and the (key, cells) of each
+        self.pending_states = []
+        self.pending_cells = []
+        self.remapped = {}
+        self.pending_moves = []
+        self.pending_move_keys = set()
+        self.pending_moves_in = {}
+        self.pending_expanded = []
+        self.uncommitted_states = 0
+        self.last_commit = time.time()
+
+    def buffer_writes(self, flush_states: int = FLUSH_STATES, flush_ms: float = FLUSH_MS) -> None:
+        """ Hold rows in memory and commit every flush_states states or flush_ms milliseconds, 0 for no limit """
+        self.flush()
+        self.remapped.clear()
+        self.flush_states = flush_states
+        self.flush_ms = flush_ms
+        self.buffering = bool(flush_states or flush_ms)
+
+    def pending_index(self, state_id: int) -> Optional[int]:
+        """ Return where a buffered state is in pending_states, None if it is not buffered """
+        if self.pending_states:
+            index = state_id - self.pending_states[0][1]
+            if 0 <= index < len(self.pending_states):
+                return index
+        return None
+
+    def flush(self) -> None:
+        """ Write the buffered rows with executemany, in the open transaction """
+        if self.pending_states:
+            changes = self.total_changes
+            self.executemany("""
+            INSERT OR IGNORE INTO
+            GameTree (StartState, GameState, Board, Score, ActiveSpaces,
+                        TotLineLen, LineLenVal, GameOver, DepthLvl)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, self.pending_states)
+            if self.total_changes - changes < len(self.pending_states):
+                self.remap_stored_states()
+            # Remapped IDs are not in the table, and must not be handed out again
+            self.min_state_id = self.pending_states[-1][1] + 1
+            self.pending_states.clear()
+            self.pending_cells.clear()
+        remapped = self.remapped
+        if remapped:
+            self.pending_moves = [(start_state, remapped.get(from_state, from_state),
+                                   remapped.get(to_state, to_state), *move)
+                                  for start_state, from_state, to_state, *move in self.pending_moves]
+            self.pending_expanded = [(remapped.get(state_id, state_id),) for state_id, in self.pending_expanded]
+        if self.pending_moves:
+            self.executemany("""
+            INSERT OR IGNORE INTO
+            Moves (StartState, FromState, ToState, MoveFromRow, MoveFromCol, MoveToRow, MoveToCol)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, self.pending_moves)
+            self.pending_moves.clear()
+            self.pending_move_keys.clear()
+            self.pending_moves_in.clear()
+        if self.pending_expanded:
+            self.executemany("UPDATE GameTree SET Expanded = 1 WHERE GameState = ?", self.pending_expanded)
+            self.pending_expanded.clear()
+        # The table is up to date again, read the next ID from it
+        self.next_state_id = None
+
+    def remap_stored_states(self) -> None:
+        """
+        Map the IDs of buffered states the table already had to the stored IDs
+
+        Only needed for boards stored before the connection was opened or
+        since dropped from the cache, the buffered IDs are consecutive so
+        the ones written are found with one range query.
+        """
+        first_id = self.pending_states[0][1]
+        last_id = self.pending_states[-1][1]
+        written = {row[0] for row in self.execute("SELECT GameState FROM GameTree WHERE GameState BETWEEN ? AND ?",
+                                                  (first_id, last_id))}
+        for row, (key, cells) in zip(self.pending_states, self.pending_cells):
+            start_state, state_id, board = row[:3]
+            if state_id not in written:
+                stored_id = self.execute("SELECT GameState FROM GameTree WHERE StartState = ? AND Board = ?",
+                                         (start_state, board)).fetchone()[0]
+                self.remapped[state_id] = stored_id
+                cache_state_id(self.state_ids, start_state, key, cells, stored_id)
+
+    def rollback(self):
+        self.state_ids.clear()
+        self.pending_states.clear()
+        self.pending_cells.clear()
+        self.remapped.clear()
+        self.pending_moves.clear()
+        self.pending_move_keys.clear()
+        self.pending_moves_in.clear()
+        self.pending_expanded.clear()
+        self.next_state_id = None
+        self.uncommitted_states = 0
+        super().rollback()
+
+
+def commit_writes(conn: sqlite3.Connection, states: int = 1, force: bool = False) -> None:
+    """
+    Commit after expanding states
+
+    A buffering StateCacheConnection only writes and commits once its
+    flush_states or flush_ms is reached, or with force set.
+    """
+    if getattr(conn, 'buffering', False):
+        conn.uncommitted_states += states
+        if not (force
+                or (conn.flush_states and conn.uncommitted_states >= conn.flush_states)
+                or (conn.flush_ms and (time.time() - conn.last_commit) * 1000 >= conn.flush_ms)):
+            return
+        conn.flush()
+        conn.uncommitted_states = 0
+        conn.last_commit = time.time()
+    conn.commit()
+
+
+def flush_writes(conn: sqlite3.Connection) -> None:
+    """ Write any buffered rows, so this connection can read them back """
+    if getattr(conn, 'buffering', False):
+        conn.flush()
+
+
+def mark_expanded(conn: sqlite3.Connection, state_ids) -> None:
+    """ Set Expanded on states whose moves have been stored, taking them out of the frontier """
+    rows = [(state_id,) for state_id in state_ids]
+    if getattr(conn, 'buffering', False):
+        conn.pending_expanded.extend(rows)
+    else:
+        conn.executemany("UPDATE GameTree SET Expanded = 1 WHERE GameState = ?", rows)
+
+
+def add_expanded_column(conn: sqlite3.Connection) -> None:
+    """
+    Bring a database from before the Expanded flag up to date
+
+    Adds the column, sets it on every state with stored moves and creates
+    the frontier index. Does nothing to a database that already has them.
+    """
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(GameTree)")]
+    if columns and 'Expanded' not in columns:
+        print("Adding the Expanded column, this can take a while on a large database")
+        conn.execute("ALTER TABLE GameTree ADD COLUMN Expanded INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE GameTree SET Expanded = 1 WHERE GameState IN (SELECT FromState FROM Moves)")
+        conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_frontier ON GameTree(StartState, LineLenVal, DepthLvl, Score)
+        WHERE GameOver = '0' AND Expanded = 0
+        """)
+        conn.commit()
+
+
+def board_cells(board: str) -> bytes:
+    """ Return the cells of save_game board text """
+    return bytes([CARD_ID[card_str] for card_str in board.split()])
+
+
+def cached_state_id(state_ids: dict, start_state: int, key: int, cells) -> Optional[int]:
+    """ Return the cached GameState ID of a board, None if it is not cached """
+    entry = state_ids.get(start_state << 64 | key)
+    if entry is not None and entry & 0xFFFFFFFF == zlib.crc32(cells):
+        return entry >> 32
+    return None
+
+
+def cache_state_id(state_ids: dict, start_state: int, key: int, cells, state_id: int) -> None:
+    """ Remember the GameState ID of a board, starting over once STATE_ID_CACHE_SIZE are held """
+    if len(state_ids) >= STATE_ID_CACHE_SIZE:
+        state_ids.clear()
+    state_ids[start_state << 64 | key] = state_id << 32 | zlib.crc32(cells)
+
+
+class SQLiteStateStore(StateStore):
+    """
+    Store in a db/schema.sql database, the tables the rest of the tools read
+
+    Writes go through a StateCacheConnection, so a state stored before is
+    found in memory and, after buffer_writes, rows are written in batches.
+    Boards are matched on their text through idx_unique_board, so keys are
+    not stored. A buffered state found on reading it to be stored already
+    under another ID is expanded under that ID instead, get_state returns
+    None for it.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, factory=StateCacheConnection)
+        # self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA journal_mode=MEMORY;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self.conn.execute("PRAGMA cache_size=-1048576;")
+        # self.conn.execute("PRAGMA mmap_size=30064771072;")  # 28GB mmap
+        self.conn.execute("PRAGMA busy_timeout=30000;")
+        if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'GameTree'").fetchone():
+            with open(SCHEMA_PATH, 'r') as f:
+                self.conn.executescript(f.read())
+        # frontier reads through idx_frontier, which older databases do not have yet
+        add_expanded_column(self.conn)
+        self.cursor = self.conn.cursor()
+
+    def put_state(self, start_state, key, cells, score, active_spaces, tot_line_len, line_len_val,
+                  game_over, depth):
+        if not start_state:
+            return self._put_start_state(key, cells, score, active_spaces, tot_line_len, line_len_val,
+                                         game_over)
+        conn = self.conn
+        state_ids = conn.state_ids
+        state_id = cached_state_id(state_ids, start_state, key, cells)
+        if state_id is not None:
+            return state_id, False
+
+        board = cells_to_text(cells)
+        if conn.buffering:
+            # Buffered states must stay in the cache, so it only starts over after a flush
+            if len(state_ids) >= STATE_ID_CACHE_SIZE:
+                conn.flush()
+                state_ids.clear()
+            if conn.next_state_id is None:
+                self.cursor.execute("SELECT MAX(GameState) FROM GameTree")
+                conn.next_state_id = max((self.cursor.fetchone()[0] or 0) + 1, conn.min_state_id)
+            state_id = conn.next_state_id
+            conn.next_state_id += 1
+            conn.pending_states.append((start_state, state_id, board, score, active_spaces, tot_line_len,
+                                        line_len_val, game_over, depth))
+            conn.pending_cells.append((key, bytes(cells)))
+            inserted = True
+        else:
+            self.cursor.execute("""
+            INSERT OR IGNORE INTO
+            GameTree (StartState, Board, Score, ActiveSpaces,
+                        TotLineLen, LineLenVal, GameOver, DepthLvl)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (start_state, board, score, active_spaces, tot_line_len, line_len_val, game_over, depth))
+            inserted = self.cursor.rowcount == 1
+            if inserted:
+                state_id = self.cursor.lastrowid
+            else:
+                # Stored before this connection was opened
+                self.cursor.execute("SELECT GameState FROM GameTree WHERE StartState = ? AND Board = ?",
+                                    (start_state, board))
+                state_id = self.cursor.fetchone()[0]
+        cache_state_id(state_ids, start_state, key, cells, state_id)
+        return state_id, inserted
+
+    def _put_start_state(self, key, cells, score, active_spaces, tot_line_len, line_len_val, game_over):
+        """ put_state for a start state, NULL StartState is not unique so it is looked up first """
+        # Buffered IDs must be in the table before SQLite picks the next one
+        flush_writes(self.conn)
+        state_id = self.get_id(0, key, cells)
+        if state_id is not None:
+            return state_id, False
+        self.cursor.execute("""
+        INSERT INTO GameTree (Board, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver, DepthLvl)
+        VALUES (?, ?, ?, ?, ?, ?, 0)
+        """, (cells_to_text(cells), score, active_spaces, tot_line_len, line_len_val, game_over))
+        state_id = self.cursor.lastrowid
+        self.cursor.execute("UPDATE GameTree SET StartState = GameState WHERE GameState = ?", (state_id,))
+        return state_id, True
+
+    def get_id(self, start_state, key, cells):
+        if start_state:
+            state_id = cached_state_id(self.conn.state_ids, start_state, key, cells)
+            if state_id is not None:
+                return state_id
+            # Buffered states are always in the cache, so the table has the rest
+            self.cursor.execute("SELECT GameState FROM GameTree WHERE StartState = ? AND Board = ?",
+                                (start_state, cells_to_text(cells)))
+        else:
+            # Start states are the only states at depth 0, so idx_depth narrows the search to them
+            self.cursor.execute("""
+            SELECT GameState
+            FROM GameTree INDEXED BY idx_depth
+            WHERE DepthLvl = 0
+            AND StartState = GameState
+            AND Board = ?
+            """, (cells_to_text(cells),))
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def _stored_state(self, row) -> StoredState:
+        state_id, start_state, board, score, active_spaces, tot_line_len, line_len_val, \
+            game_over, depth, expanded = row
+        cells = board_cells(board) if board is not None else None
+        return StoredState(state_id, start_state, cells_hash(cells) if cells else None, cells, score,
+                           active_spaces, tot_line_len, line_len_val, int(game_over), depth,
+                           bool(expanded) or (state_id,) in self.conn.pending_expanded)
+
+    def get_state(self, state_id):
+        conn = self.conn
+        if state_id in conn.remapped:
+            return None
+        index = conn.pending_index(state_id)
+        if index is None:
+            self.cursor.execute("""
+            SELECT GameState, StartState, Board, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver,
+                   DepthLvl, Expanded
+            FROM GameTree
+            WHERE GameState = ?
+            """, (state_id,))
+            row = self.cursor.fetchone()
+            return self._stored_state(row) if row else None
+
+        # Buffered as new, looked for in the table once here rather than once per child
+        start_state, _, board, score, active_spaces, tot_line_len, line_len_val, game_over, depth = \
+            conn.pending_states[index]
+        self.cursor.execute("SELECT GameState FROM GameTree WHERE StartState = ? AND Board = ?",
+                            (start_state, board))
+        row = self.cursor.fetchone()
+        if row:
+            conn.remapped[state_id] = row[0]
+            return None
+        key, cells = conn.pending_cells[index]
+        return StoredState(state_id, start_state, key, cells, score, active_spaces, tot_line_len, line_len_val,
+                           int(game_over), depth, (state_id,) in conn.pending_expanded)
+
+    def add_edge(self, start_state, from_id, to_id, from_cell, to_cell):
+        (from_row, from_col), (to_row, to_col) = CELL_RC[from_cell], CELL_RC[to_cell]
+        conn = self.conn
+        if conn.buffering:
+            # A move already in the table is left to INSERT OR IGNORE
+            move_key = (from_id, to_id)
+            if move_key not in conn.pending_move_keys:
+                conn.pending_moves.append((start_state, from_id, to_id, from_row, from_col, to_row, to_col))
+                conn.pending_move_keys.add(move_key)
+                conn.pending_moves_in.setdefault(to_id, []).append((from_id, from_cell, to_cell))
+        else:
+            self.cursor.execute("""
+            INSERT OR IGNORE INTO
+            Moves (StartState, FromState, ToState, MoveFromRow, MoveFromCol, MoveToRow, MoveToCol)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (start_state, from_id, to_id, from_row, from_col, to_row, to_col))
+
+    def mark_expanded(self, state_id):
+        mark_expanded(self.conn, [state_id])
+
+    def frontier(self, start_state=0, with_cells=True):
+        flush_writes(self.conn)
+        board_column = "Board" if with_cells else "NULL"
+        query = f"""
+        SELECT GameState, StartState, {board_column}, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver,
+               DepthLvl, Expanded
+        FROM GameTree INDEXED BY idx_frontier
+        WHERE GameOver = '0'
+        AND Expanded = 0
+        """
+        if start_state:
+            rows = self.conn.execute(query + "AND StartState = ?", (start_state,)).fetchall()
+        else:
+            rows = self.conn.execute(query).fetchall()
+        return [self._stored_state(row) for row in rows]
+
+    def moves_into(self, state_id):
+        self.cursor.execute("""
+        SELECT FromState, MoveFromRow, MoveFromCol, MoveToRow, MoveToCol
+        FROM Moves
+        WHERE ToState = ?
+        """, (state_id,))
+        moves = [(from_state, from_row * ROW_LEN + from_col, to_row * ROW_LEN + to_col)
+                 for from_state, from_row, from_col, to_row, to_col in self.cursor.fetchall()]
+        return moves + self.conn.pending_moves_in.get(state_id, [])
+
+    def start_states(self):
+        flush_writes(self.conn)
+        self.cursor.execute("""
+        SELECT GameState
+        FROM GameTree INDEXED BY idx_depth
+        WHERE DepthLvl = 0
+        AND StartState = GameState
+        ORDER BY GameState
+        """)
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def best_state(self, start_state):
+        flush_writes(self.conn)
+        self.cursor.execute("""
+        SELECT GameState, StartState, Board, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver,
+               DepthLvl, Expanded
+        FROM GameTree
+        WHERE StartState = ?
+        ORDER BY Score DESC, DepthLvl
+        LIMIT 1
+        """, (start_state,))
+        row = self.cursor.fetchone()
+        return self._stored_state(row) if row else None
+
+    def clean(self, start_state, keep):
+        self.commit()
+        keep = list(keep)
+        placeholders = ', '.join('?' * len(keep))
+        # Acquire an exclusive lock on the database
+        self.cursor.execute("BEGIN EXCLUSIVE TRANSACTION")
+        self.cursor.execute("DELETE FROM Moves WHERE StartState = ?", (start_state,))
+        deleted_moves = self.cursor.rowcount
+        self.cursor.execute(f"DELETE FROM GameTree WHERE StartState = ? AND GameState NOT IN ({placeholders})",
+                            (start_state, *keep))
+        deleted_states = self.cursor.rowcount
+        # With their moves gone the kept states are back in the frontier
+        self.cursor.execute(f"UPDATE GameTree SET Expanded = 0 WHERE GameState IN ({placeholders})", keep)
+        self.conn.commit()
+        self.conn.state_ids.clear()
+        return deleted_states, deleted_moves
+
+    def buffer_writes(self, flush_states=FLUSH_STATES, flush_ms=FLUSH_MS):
+        self.conn.buffer_writes(flush_states, flush_ms)
+
+    def commit_writes(self, states=1, force=False):
+        commit_writes(self.conn, states, force)
+
+    def commit(self):
+        commit_writes(self.conn, 0, force=True)
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def vacuum(self):
+        self.conn.execute("VACUUM")
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class CompactStateStore(StateStore):
+    """
+    Store in a db/schema_compact.sql database, states keyed by board key with packed boards
+
+    The schema has no state IDs, so a state's ID is its (StartKey, StateKey)
+    pair as unsigned keys in one 128-bit int, the same every time the
+    database is opened. Two boards sharing a key under one start state
+    cannot both be stored, so putting the second raises ValueError.
+    """
+
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=MEMORY;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self.conn.execute("PRAGMA cache_size=-1048576;")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(GameTree)")]
+        if not columns:
+            with open(COMPACT_SCHEMA_PATH, 'r') as f:
+                self.conn.executescript(f.read())
+        elif 'StateKey' not in columns:
+            self.conn.close()
+            raise ValueError(f"{db_path} does not have the compact schema")
+        self.cursor = self.conn.cursor()
+
+    @staticmethod
+    def _state_id(start_key: int, state_key: int) -> int:
+        """ Return the ID of the state with a (StartKey, StateKey) pair """
+        return (start_key & HASH_MASK) << 64 | (state_key & HASH_MASK)
+
+    @staticmethod
+    def _keys(state_id: int) -> Tuple[int, int]:
+        """ Return the (StartKey, StateKey) pair of a state ID as signed keys """
+        return signed_key(state_id >> 64 & HASH_MASK), signed_key(state_id & HASH_MASK)
+
+    def put_state(self, start_state, key, cells, score, active_spaces, tot_line_len, line_len_val,
+                  game_over, depth):
+        state_key = signed_key(key)
+        # A start state is keyed on its own board
+        start_key = self._keys(start_state)[1] if start_state else state_key
+        self.cursor.execute("""
+        INSERT OR IGNORE INTO
+        GameTree (StartKey, StateKey, Board, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver, DepthLvl)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (start_key, state_key, pack_cells(cells), score, active_spaces, tot_line_len, line_len_val,
+              int(game_over), depth))
+        if self.cursor.rowcount == 1:
+            return self._state_id(start_key, state_key), True
+        state_id = self.get_id(start_state, key, cells)
+        if state_id is None:
+            raise ValueError(f"Board key {key:016x} is already stored for another board")
+        return state_id, False
+
+    def get_id(self, start_state, key, cells):
+        state_key = signed_key(key)
+        start_key = self._keys(start_state)[1] if start_state else state_key
+        self.cursor.execute("SELECT Board FROM GameTree WHERE StartKey = ? AND StateKey = ?",
+                            (start_key, state_key))
+        row = self.cursor.fetchone()
+        if row is None or row[0] != pack_cells(cells):
+            return None
+        return self._state_id(start_key, state_key)
+
+    def _stored_state(self, row) -> StoredState:
+        start_key, state_key, packed, score, active_spaces, tot_line_len, line_len_val, \
+            game_over, depth, expanded = row
+        return StoredState(self._state_id(start_key, state_key), self._state_id(start_key, start_key),
+                           state_key & HASH_MASK if packed is not None else None,
+                           bytes(unpack_cells(packed)) if packed is not None else None, score, active_spaces,
+                           tot_line_len, line_len_val, game_over, depth, bool(expanded))
+
+    def get_state(self, state_id):
+        self.cursor.execute("""
+        SELECT StartKey, StateKey, Board, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver,
+               DepthLvl, Expanded
+        FROM GameTree
+        WHERE StartKey = ? AND StateKey = ?
+        """, self._keys(state_id))
+        row = self.cursor.fetchone()
+        return self._stored_state(row) if row else None
+
+    def add_edge(self, start_state, from_id, to_id, from_cell, to_cell):
+        start_key, from_key = self._keys(from_id)
+        self.cursor.execute("""
+        INSERT OR IGNORE INTO Moves (StartKey, FromKey, ToKey, MoveFrom, MoveTo)
+        VALUES (?, ?, ?, ?, ?)
+        """, (start_key, from_key, self._keys(to_id)[1], from_cell, to_cell))
+
+    def mark_expanded(self, state_id):
+        self.cursor.execute("UPDATE GameTree SET Expanded = 1 WHERE StartKey = ? AND StateKey = ?",
+                            self._keys(state_id))
+
+    def frontier(self, start_state=0, with_cells=True):
+        board_column = "Board" if with_cells else "NULL"
+        query = f"""
+        SELECT StartKey, StateKey, {board_column}, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver,
+               DepthLvl, Expanded
+        FROM GameTree INDEXED BY idx_frontier
+        WHERE GameOver = 0
+        AND Expanded = 0
+        """
+        if start_state:
+            rows = self.conn.execute(query + "AND StartKey = ?", (self._keys(start_state)[1],)).fetchall()
+        else:
+            rows = self.conn.execute(query).fetchall()
+        return [self._stored_state(row) for row in rows]
+
+    def moves_into(self, state_id):
+        start_key, to_key = self._keys(state_id)
+        self.cursor.execute("""
+        SELECT FromKey, MoveFrom, MoveTo
+        FROM Moves
+        WHERE StartKey = ? AND ToKey = ?
+        """, (start_key, to_key))
+        return [(self._state_id(start_key, from_key), from_cell, to_cell)
+                for from_key, from_cell, to_cell in self.cursor.fetchall()]
+
+    def start_states(self):
+        # Steps from one StartKey to the next through the primary key instead of reading every state
+        self.cursor.execute("""
+        WITH RECURSIVE start_keys(StartKey) AS (
+            SELECT MIN(StartKey) FROM GameTree
+            UNION ALL
+            SELECT (SELECT MIN(StartKey) FROM GameTree WHERE StartKey > start_keys.StartKey)
+            FROM start_keys
+            WHERE start_keys.StartKey IS NOT NULL
+        )
+        SELECT StartKey FROM start_keys WHERE StartKey IS NOT NULL
+        """)
+        return [self._state_id(start_key, start_key) for start_key, in self.cursor.fetchall()]
+
+    def best_state(self, start_state):
+        self.cursor.execute("""
+        SELECT StartKey, StateKey, Board, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver,
+               DepthLvl, Expanded
+        FROM GameTree
+        WHERE StartKey = ?
+        ORDER BY Score DESC, DepthLvl
+        LIMIT 1
+        """, (self._keys(start_state)[1],))
+        row = self.cursor.fetchone()
+        return self._stored_state(row) if row else None
+
+    def clean(self, start_state, keep):
+        self.commit()
+        start_key = self._keys(start_state)[1]
+        keep_keys = [self._keys(state_id)[1] for state_id in keep]
+        placeholders = ', '.join('?' * len(keep_keys))
+        self.cursor.execute("BEGIN EXCLUSIVE TRANSACTION")
+        self.cursor.execute("DELETE FROM Moves WHERE StartKey = ?", (start_key,))
+        deleted_moves = self.cursor.rowcount
+        self.cursor.execute(f"DELETE FROM GameTree WHERE StartKey = ? AND StateKey NOT IN ({placeholders})",
+                            (start_key, *keep_keys))
+        deleted_states = self.cursor.rowcount
+        self.cursor.execute(f"UPDATE GameTree SET Expanded = 0 WHERE StartKey = ? AND StateKey IN ({placeholders})",
+                            (start_key, *keep_keys))
+        self.conn.commit()
+        return deleted_states, deleted_moves
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def vacuum(self):
+        self.conn.execute("VACUUM")
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class MemoryStateStore(StateStore):
+    """
+    Store in Python lists and dicts, for searches that fit in memory and need no record
+
+    clean leaves None in place of a dropped state, so IDs stay list positions.
+    """
+
+    def __init__(self):
+        self.states: List[Optional[StoredState]] = []
+        self.state_ids: Dict[Tuple[int, int, bytes], int] = {}
+        self.moves_in: Dict[int, List[Tuple[int, int, int]]] = {}
+
+    def put_state(self, start_state, key, cells, score, active_spaces, tot_line_len, line_len_val,
+                  game_over, depth):
+        cells = bytes(cells)
+        state_key = (start_state, key, cells)
+        state_id = self.state_ids.get(state_key)
+        if state_id is not None:
+            return state_id, False
+        state_id = len(self.states) + 1
+        self.states.append(StoredState(state_id, start_state or state_id, key, cells, score, active_spaces,
+                                       tot_line_len, line_len_val, int(game_over), depth, False))
+        self.state_ids[state_key] = state_id
+        return state_id, True
+
+    def get_id(self, start_state, key, cells):
+        return self.state_ids.get((start_state, key, bytes(cells)))
+
+    def get_state(self, state_id):
+        return self.states[state_id - 1] if 0 < state_id <= len(self.states) else None
+
+    def add_edge(self, start_state, from_id, to_id, from_cell, to_cell):
+        self.moves_in.setdefault(to_id, []).append((from_id, from_cell, to_cell))
+
+    def mark_expanded(self, state_id):
+        self.states[state_id - 1] = self.states[state_id - 1]._replace(expanded=True)
+
+    def frontier(self, start_state=0, with_cells=True):
+        return [state for state in self.states
+                if (state and not state.expanded and not state.game_over
+                    and (not start_state or state.start_state == start_state))]
+
+    def moves_into(self, state_id):
+        return list(self.moves_in.get(state_id, []))
+
+    def start_states(self):
+        return [state.state_id for state in self.states if state and state.state_id == state.start_state]
+
+    def best_state(self, start_state):
+        states = [state for state in self.states if state and state.start_state == start_state]
+        return max(states, key=lambda state: (state.score, -state.depth), default=None)
+
+    def clean(self, start_state, keep):
+        deleted_moves = 0
+        for to_id in [to_id for to_id in self.moves_in if self.states[to_id - 1].start_state == start_state]:
+            deleted_moves += len(self.moves_in.pop(to_id))
+        deleted_states = 0
+        for index, state in enumerate(self.states):
+            if state and state.start_state == start_state:
+                if state.state_id in keep:
+                    self.states[index] = state._replace(expanded=False)
+                else:
+                    self.states[index] = None
+                    del self.state_ids[(0 if state.state_id == start_state else start_state, state.key,
+                                        state.cells)]
+                    deleted_states += 1
+        return deleted_states, deleted_moves
+
+
+# Log files start with a magic and the committed record count, then fixed size records
+LOG_HEADER = struct.Struct('<8sQ')
+STATES_MAGIC = b'SASTATE2'
+MOVES_MAGIC = b'SAMOVES2'
+INDEX_MAGIC = b'SAINDEX3'
+# IDs are 64-bit, so shard IDs from SHARD_ID_SPAN up fit.
+# Key, StartState, packed board, Score, ActiveSpaces, TotLineLen, LineLenVal, GameOver, DepthLvl, Expanded
+STATE_RECORD = struct.Struct('<QQ42sBBHdBHB')
+START_OFFSET = 8
+BOARD_OFFSET = 16
+GAME_OVER_OFFSET = 70
+EXPANDED_OFFSET = 73
+# StartState, FromState, ToState, from cell, to cell
+MOVE_RECORD = struct.Struct('<QQQBB')
+# Index slots are (hash, state ID), ID 0 for an empty slot. The header holds
+# the indexed state count, the slot count and a dirty flag set while slots
+# are written past the last commit
+INDEX_HEADER = struct.Struct('<8sQQB')
+INDEX_SLOT = struct.Struct('<QQ')
+INDEX_MIN_SLOTS = 1 << 16
+
+
+class MappedFile:
+    """ A file of fixed size records after a header, mapped in memory and grown by doubling """
+
+    def __init__(self, path: str, header_size: int, record_size: int, initial_records: int):
+        self.header_size = header_size
+        self.record_size = record_size
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'r+b' if not new_file else 'w+b')
+        if new_file:
+            self.file.truncate(header_size + record_size * initial_records)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def capacity(self) -> int:
+        return (len(self.map) - self.header_size) // self.record_size
+
+    def reserve(self, records: int) -> None:
+        """ Make room for at least records records """
+        if records <= self.capacity():
+            return
+        size = self.header_size + self.record_size * max(records, 2 * self.capacity())
+        self.map.close()
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def offset(self, index: int) -> int:
+        return self.header_size + self.record_size * index
+
+    def flush(self) -> None:
+        self.map.flush()
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+
+class LogStateStore(StateStore):
+    """
+    Store in append-only record logs with an on-disk hash index, all memory mapped
+
+    path.states holds fixed size state records in ID order and path.moves
+    the moves, both only ever appended to apart from the Expanded byte of a
+    state and clean, which sets StartState 0 on the states it drops and
+    writes the moves log again without theirs. path.index is an open addressing hash table from the hash of
+    (StartState, key) to the state ID, doubled once half full. Each file's
+    header holds its committed count, so records written after the last
+    commit are dropped on reopening. The index is marked dirty before its
+    first slot after a commit is written, and a dirty index or one that
+    does not match the log is rebuilt from the log, so no slot can point
+    past the committed states. Expanded is only set at a commit, once the
+    children it stands for are in the log.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.states = MappedFile(path + '.states', LOG_HEADER.size, STATE_RECORD.size, 1 << 16)
+        self.moves = MappedFile(path + '.moves', LOG_HEADER.size, MOVE_RECORD.size, 1 << 16)
+        self.num_states = self._open_log(self.states, STATES_MAGIC)
+        self.num_moves = self._open_log(self.moves, MOVES_MAGIC)
+        self.pending_expanded: Set[int] = set()
+        # Moves into each state as in moves_into, read from the log the first time it is needed
+        self.moves_in: Optional[Dict[int, List[Tuple[int, int, int]]]] = None
+
+        self.index = MappedFile(path + '.index', INDEX_HEADER.size, INDEX_SLOT.size, INDEX_MIN_SLOTS)
+        self.index_dirty = False
+        magic, indexed, slots, dirty = INDEX_HEADER.unpack_from(self.index.map, 0)
+        if magic != INDEX_MAGIC or dirty or indexed != self.num_states or slots != self.index.capacity():
+            slots = INDEX_MIN_SLOTS
+            while 2 * self.num_states > slots:
+                slots *= 2
+            self._rebuild_index(slots)
+
+    @staticmethod
+    def _open_log(log: MappedFile, magic: bytes) -> int:
+        """ Return a log's committed record count, writing the header of a new log """
+        file_magic, count = LOG_HEADER.unpack_from(log.map, 0)
+        if file_magic == magic:
+            return count
+        if file_magic[:-1] == magic[:-1]:
+            raise ValueError(f"{log.file.name} was written by another version of the state store")
+        if file_magic != bytes(len(magic)):
+            raise ValueError(f"{log.file.name} is not a state store log")
+        LOG_HEADER.pack_into(log.map, 0, magic, 0)
+        return 0
+
+    @staticmethod
+    def _slot_hash(start_state: int, key: int) -> int:
+        """ Hash (StartState, key) to a non-zero 64-bit value """
+        return ((key ^ (start_state * 0x9E3779B97F4A7C15)) & HASH_MASK) or 1
+
+    def _find_slot(self, slot_hash: int, start_state: int, cells) -> Tuple[int, int]:
+        """ Return (slot, state ID) of a state, or (free slot, 0) if it is not stored """
+        packed = None
+        index_map = self.index.map
+        mask = self.index.capacity() - 1
+        slot = slot_hash & mask
+        while True:
+            stored_hash, state_id = INDEX_SLOT.unpack_from(index_map, self.index.offset(slot))
+            if not state_id:
+                return slot, 0
+            if stored_hash == slot_hash:
+                offset = self.states.offset(state_id - 1)
+                record_start, = struct.unpack_from('<Q', self.states.map, offset + START_OFFSET)
+                # A start state's record holds its own ID as StartState
+                if record_start == (start_state or state_id):
+                    # Boards are only packed to rule out a shared key
+                    packed = packed or pack_cells(cells)
+                    if self.states.map[offset + BOARD_OFFSET:offset + BOARD_OFFSET + len(packed)] == packed:
+                        return slot, state_id
+            slot = (slot + 1) & mask
+
+    def _rebuild_index(self, slots: int) -> None:
+        """ Recreate the index with slots slots, a power of two, from the state log """
+        self.index.map.close()
+        self.index.file.truncate(INDEX_HEADER.size + INDEX_SLOT.size * slots)
+        self.index.map = mmap.mmap(self.index.file.fileno(), 0)
+        self.index.map[:] = bytes(len(self.index.map))
+        mask = slots - 1
+        index_map = self.index.map
+        for state_id in range(1, self.num_states + 1):
+            key, start_state = struct.unpack_from('<QQ', self.states.map, self.states.offset(state_id - 1))
+            if not start_state:
+                continue
+            slot_hash = self._slot_hash(start_state if start_state != state_id else 0, key)
+            slot = slot_hash & mask
+            while INDEX_SLOT.unpack_from(index_map, self.index.offset(slot))[1]:
+                slot = (slot + 1) & mask
+            INDEX_SLOT.pack_into(index_map, self.index.offset(slot), slot_hash, state_id)
+        INDEX_HEADER.pack_into(index_map, 0, INDEX_MAGIC, self.num_states, slots, self.index_dirty)
+
+    def _mark_index_dirty(self) -> None:
+        """ Flag the index on disk as holding uncommitted slots, before the first is written """
+        if not self.index_dirty:
+            self.index_dirty = True
+            INDEX_HEADER.pack_into(self.index.map, 0, INDEX_MAGIC, self.num_states, self.index.capacity(), True)
+            self.index.flush()
+
+    def put_state(self, start_state, key, cells, score, active_spaces, tot_line_len, line_len_val,
+                  game_over, depth):
+        slot_hash = self._slot_hash(start_state, key)
+        slot, state_id = self._find_slot(slot_hash, start_state, cells)
+        if state_id:
+            return state_id, False
+
+        state_id = self.num_states + 1
+        self.states.reserve(state_id)
+        STATE_RECORD.pack_into(self.states.map, self.states.offset(state_id - 1), key, start_state or state_id,
+                               pack_cells(cells), score, active_spaces, tot_line_len, line_len_val, int(game_over),
+                               depth, 0)
+        self.num_states = state_id
+        self._mark_index_dirty()
+        INDEX_SLOT.pack_into(self.index.map, self.index.offset(slot), slot_hash, state_id)
+        if 2 * self.num_states > self.index.capacity():
+            self._rebuild_index(2 * self.index.capacity())
+        return state_id, True
+
+    def get_id(self, start_state, key, cells):
+        return self._find_slot(self._slot_hash(start_state, key), start_state, cells)[1] or None
+
+    def _stored_state(self, state_id: int, record: tuple, with_cells: bool = True) -> StoredState:
+        key, start_state, packed, score, active_spaces, tot_line_len, line_len_val, game_over, \
+            depth, expanded = record
+        return StoredState(state_id, start_state, key if with_cells else None,
+                           bytes(unpack_cells(packed)) if with_cells else None, score, active_spaces,
+                           tot_line_len, line_len_val, game_over, depth,
+                           bool(expanded) or state_id in self.pending_expanded)
+
+    def _records(self):
+        """ Yield (state ID, offset) of every state clean has not dropped """
+        for state_id in range(1, self.num_states + 1):
+            offset = self.states.offset(state_id - 1)
+            if struct.unpack_from('<Q', self.states.map, offset + START_OFFSET)[0]:
+                yield state_id, offset
+
+    def get_state(self, state_id):
+        if not 0 < state_id <= self.num_states:
+            return None
+        record = STATE_RECORD.unpack_from(self.states.map, self.states.offset(state_id - 1))
+        return self._stored_state(state_id, record) if record[1] else None
+
+    def add_edge(self, start_state, from_id, to_id, from_cell, to_cell):
+        self.moves.reserve(self.num_moves + 1)
+        MOVE_RECORD.pack_into(self.moves.map, self.moves.offset(self.num_moves),
+                              start_state, from_id, to_id, from_cell, to_cell)
+        self.num_moves += 1
+        if self.moves_in is not None:
+            self.moves_in.setdefault(to_id, []).append((from_id, from_cell, to_cell))
+
+    def mark_expanded(self, state_id):
+        self.pending_expanded.add(state_id)
+
+    def frontier(self, start_state=0, with_cells=True):
+        # Scans the log, reading just the fields needed to skip a state. Done before
+        # returning, as growing the log maps it again and closes states_map
+        states_map = self.states.map
+        states = []
+        for state_id, offset in self._records():
+            if (states_map[offset + EXPANDED_OFFSET] or states_map[offset + GAME_OVER_OFFSET]
+                    or state_id in self.pending_expanded):
+                continue
+            if start_state and struct.unpack_from('<Q', states_map, offset + START_OFFSET)[0] != start_state:
+                continue
+            states.append(self._stored_state(state_id, STATE_RECORD.unpack_from(states_map, offset), with_cells))
+        return states
+
+    def moves_into(self, state_id):
+        if self.moves_in is None:
+            self.moves_in = {}
+            for index in range(self.num_moves):
+                _, from_id, to_id, from_cell, to_cell = MOVE_RECORD.unpack_from(self.moves.map,
+                                                                                 self.moves.offset(index))
+                self.moves_in.setdefault(to_id, []).append((from_id, from_cell, to_cell))
+        return list(self.moves_in.get(state_id, []))
+
+    def start_states(self):
+        return [state_id for state_id, offset in self._records()
+                if struct.unpack_from('<Q', self.states.map, offset + START_OFFSET)[0] == state_id]
+
+    def best_state(self, start_state):
+        best = None
+        for state_id, offset in self._records():
+            record = STATE_RECORD.unpack_from(self.states.map, offset)
+            if record[1] == start_state and (best is None or (record[3], -record[8]) > (best[1][3], -best[1][8])):
+                best = state_id, record
+        return self._stored_state(*best) if best else None
+
+    def clean(self, start_state, keep):
+        """
+        Drop the moves and the states of a start state other than those in keep
+
+        States first, then the moves log is written to a new file that
+        replaces the old one, so cleaning again finishes an interrupted clean.
+        """
+        self.commit()
+        deleted_states = 0
+        for state_id, offset in list(self._records()):
+            if struct.unpack_from('<Q', self.states.map, offset + START_OFFSET)[0] != start_state:
+                continue
+            if state_id in keep:
+                self.states.map[offset + EXPANDED_OFFSET] = 0
+            else:
+                struct.pack_into('<Q', self.states.map, offset + START_OFFSET, 0)
+                deleted_states += 1
+        self.states.flush()
+        self._mark_index_dirty()
+        self._rebuild_index(self.index.capacity())
+
+        moves_path = self.path + '.moves'
+        if os.path.exists(moves_path + '.tmp'):
+            os.remove(moves_path + '.tmp')
+        kept_moves = MappedFile(moves_path + '.tmp', LOG_HEADER.size, MOVE_RECORD.size, max(self.num_moves, 1))
+        num_kept = 0
+        for index in range(self.num_moves):
+            move = self.moves.map[self.moves.offset(index):self.moves.offset(index + 1)]
+            if struct.unpack_from('<Q', move)[0] != start_state:
+                kept_moves.map[kept_moves.offset(num_kept):kept_moves.offset(num_kept + 1)] = move
+                num_kept += 1
+        LOG_HEADER.pack_into(kept_moves.map, 0, MOVES_MAGIC, num_kept)
+        kept_moves.flush()
+        kept_moves.close()
+        self.moves.close()
+        os.replace(moves_path + '.tmp', moves_path)
+        self.moves = MappedFile(moves_path, LOG_HEADER.size, MOVE_RECORD.size, 1 << 16)
+        deleted_moves = self.num_moves - num_kept
+        self.num_moves = num_kept
+        self.moves_in = None
+        self.commit()
+        return deleted_states, deleted_moves
+
+    def commit(self):
+        # Records first, then the counts that make them part of the log
+        self.states.flush()
+        self.moves.flush()
+        LOG_HEADER.pack_into(self.states.map, 0, STATES_MAGIC, self.num_states)
+        LOG_HEADER.pack_into(self.moves.map, 0, MOVES_MAGIC, self.num_moves)
+        self.index.flush()
+        self.index_dirty = False
+        INDEX_HEADER.pack_into(self.index.map, 0, INDEX_MAGIC, self.num_states, self.index.capacity(), False)
+        for state_id in self.pending_expanded:
+            self.states.map[self.states.offset(state_id - 1) + EXPANDED_OFFSET] = 1
+        self.pending_expanded.clear()
+        self.states.flush()
+        self.moves.flush()
+        self.index.flush()
+
+    def close(self):
+        self.commit()
+        self.states.close()
+        self.moves.close()
+        self.index.close()
+
+
+def open_store(kind: str, path: Optional[str] = None) -> StateStore:
+    """
+    Open a store of the given kind
+
+    'sqlite' and 'compact' open a database with db/schema.sql or
+    db/schema_compact.sql, 'log' the files starting with path and
+    'memory' needs no path.
+    """
+    if kind == 'sqlite':
+        return SQLiteStateStore(path)
+    if kind == 'compact':
+        return CompactStateStore(path)
+    if kind == 'log':
+        return LogStateStore(path)
+    if kind == 'memory':
+        return MemoryStateStore()
+    raise ValueError(f"Unknown state store {kind}")
+
+
+def store_path(kind: str, db_path: str) -> str:
+    """ Return where the store of a kind lives, next to the SQLite database at db_path """
+    base = os.path.splitext(db_path)[0]
+    if kind == 'compact':
+        return base + '_compact.db'
+    if kind == 'log':
+        return base
+    return db_path
+
+
+def ask_store_kind() -> str:
+    """ Ask which kind of store to open, SQLite unless another is picked """
+    user_input = input("State store (S)QLite, (C)ompact or (L)og (Enter=SQLite): ").strip().lower()
+    return STORE_KINDS.get(user_input[:1], 'sqlite')
@@ -19,28 +19,22 @@ import csv
 import os
 import sys
 
-from gamestate import GameState
+from gamestate import GameState, CELL_RC
+from shards import resolve_db_path
+from statestore import ask_store_kind, open_store, store_path
 
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
-def trace_state_history(db_path, target_state_id):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
+def trace_state_history(store, target_state_id):
     state_sequence = []
     current_state = target_state_id
     steps = 0
 
     while True:
-        cursor.execute("""
-            SELECT FromState 
-            FROM Moves 
-            WHERE ToState = ?
-        """, (current_state,))
-        result = cursor.fetchone()
-
-        if result is None: # No parent state means initial state reached
+        moves_in = store.moves_into(current_state)
+
+        if not moves_in: # No parent state means initial state reached
             if not state_sequence:
                 state_sequence = [(None, current_state)]
             else:
@@ -49,35 +43,25 @@ def trace_state_history(db_path, target_state_id):
             break
 
         steps += 1
-        parent_state = result[0]
+        parent_state = moves_in[0][0]
         state_sequence.append((parent_state, current_state))
         current_state = parent_state
 
-    conn.close()
-
     # Reverse the sequence to get the path from initial state to target state
     state_sequence.reverse()
 
     return state_sequence
 
 
-def print_state_details(db_path, csvfile, from_state, to_state):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT Board, Score, DepthLvl
-        FROM GameTree
-        WHERE GameState = ?
-    """, (to_state,))
-    state_result = cursor.fetchone()
+def print_state_details(store, csvfile, from_state, to_state):
+    state = store.get_state(to_state)
 
-    if state_result:
-        board, score, depth_lvl = state_result
+    if state:
+        score, depth_lvl = state.score, state.depth
         print(f"State ID: {to_state}")
         print(f"Depth: {depth_lvl}")
 
-        game = GameState.load_game(board)
+        game = GameState(bytearray(state.cells))
         game.calc_line_len()
 
         active_spaces = sum(1 for lt in game.line_len if lt > 0)
@@ -93,14 +77,9 @@ def print_state_details(db_path, csvfile, from_state, to_state):
                                  tot_line_len, line_len_val, score])
 
         if from_state:
-            cursor.execute("""
-                SELECT MoveFromRow, MoveFromCol, MoveToRow, MoveToCol
-                FROM Moves
-                WHERE FromState = ?
-                AND ToState = ?
-            """, (from_state, to_state,))
-            move_result = cursor.fetchone()
-            MoveFromRow, MoveFromCol, MoveToRow, MoveToCol = move_result
+            from_cell, to_cell = next((from_cell, to_cell) for parent_state, from_cell, to_cell
+                                      in store.moves_into(to_state) if parent_state == from_state)
+            (MoveFromRow, MoveFromCol), (MoveToRow, MoveToCol) = CELL_RC[from_cell], CELL_RC[to_cell]
             print(f"Move from: {MoveFromRow}, {MoveFromCol}")
             print(f"Move to: {MoveToRow}, {MoveToCol}")
 
@@ -110,11 +89,11 @@ def print_state_details(db_path, csvfile, from_state, to_state):
     else:
         print(f"No data found for State ID: {from_state}")
 
-    conn.close()
-
 
 def main():
     db_path = os.path.expanduser('~/Database/GameTree.db')  # Replace with your actual database path
+    store_kind = ask_store_kind()
+    use_shards = store_kind == 'sqlite' and input("Read from shard files Y or N?: ").strip().lower() == 'y'
 
     while True:
         state_id = input("\nEnter a state ID to trace (or 'q' to quit): ")
@@ -149,17 +128,29 @@ def main():
             clear_screen()
             try:
                 state_id = int(state_id)
-                state_sequence = trace_state_history(db_path, state_id)
+            except ValueError:
+                print("Please enter a valid integer state ID.")
+                continue
+
+            try:
+                if store_kind == 'sqlite':
+                    path = resolve_db_path(db_path, state_id, use_shards)
+                else:
+                    path = store_path(store_kind, db_path)
+                store = open_store(store_kind, path)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                print(f"Error opening state store: {e}")
+                continue
+
+            try:
+                state_sequence = trace_state_history(store, state_id)
 
                 print(f"Path to reach state {state_id}:")
                 for from_state, to_state in state_sequence:
                     print(f"\nMove from state {from_state} to state {to_state}:")
-                    print_state_details(db_path, csvfile, from_state, to_state)
-
-            except ValueError:
-                print("Please enter a valid integer state ID.")
-            # except Exception as e:
-            #    print(f"An error occurred: {e}")
+                    print_state_details(store, csvfile, from_state, to_state)
+            finally:
+                store.close()
 
         finally:
             if csvfile: